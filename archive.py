@@ -0,0 +1,204 @@
+import os
+import json
+import mmap
+import datetime as dt
+from pathlib import Path
+
+import numpy as np
+
+
+MAGIC = b"GQPA"
+VERSION = 2
+# Arrays start on this boundary, so the memory-mapped views are aligned for every dtype
+ALIGN = 64
+EPOCH = dt.datetime(1970, 1, 1)
+NO_DATE = np.iinfo(np.int64).min
+DIRECTIONS = ("across", "down")
+
+
+class PuzzleRecord:
+    """
+    One puzzle as plain data. mask marks the white cells and cell_numbers holds the clue number
+    printed in each cell (0 for none), both indexed [y, x]. Each clue is (number, direction, text,
+    enumeration), with the answer lengths and the delimiter after each word but the last parsed
+    out of the enumeration into lengths and delimiters.
+    """
+    __slots__ = ("number", "date", "mask", "cell_numbers", "clues", "lengths", "delimiters")
+
+    def __init__(self, number, date, mask, cell_numbers, clues, lengths, delimiters):
+        self.number = number
+        self.date = date
+        self.mask = mask
+        self.cell_numbers = cell_numbers
+        self.clues = clues
+        self.lengths = lengths
+        self.delimiters = delimiters
+
+
+def write_archive(path, records):
+    """
+    Write puzzles to a single file that PuzzleArchive can memory-map. The file is the magic bytes,
+    the length of a JSON header and the header, followed by one flat array per field of every
+    puzzle (eg. all the grid masks end to end), with offset arrays marking where each puzzle's
+    slice starts. A later record for the same number replaces an earlier one.
+    """
+    records = sorted({r.number: r for r in records}.values(), key=lambda r: r.number)
+    cell_offsets, clue_offsets, string_offsets, part_offsets, delimiter_offsets = [0], [0], [0], [0], [0]
+    masks, cell_numbers, directions, strings, lengths, delimiters = [], [], [], [], [], []
+    for r in records:
+        masks.append(np.asarray(r.mask, dtype=np.uint8).ravel())
+        cell_numbers.append(np.asarray(r.cell_numbers, dtype=np.uint16).ravel())
+        cell_offsets.append(cell_offsets[-1] + masks[-1].size)
+        for (number, direction, text, enumeration), parts, delims in zip(r.clues, r.lengths, r.delimiters):
+            directions.append(DIRECTIONS.index(direction))
+            for s in (number, text, enumeration):
+                strings.append(s)
+                string_offsets.append(string_offsets[-1] + len(s))
+            lengths.extend(parts)
+            # One delimiter per word, empty after the last
+            words = list(delims[:max(len(parts) - 1, 0)])
+            for d in words + [""] * (len(parts) - len(words)):
+                delimiters.append(d)
+                delimiter_offsets.append(delimiter_offsets[-1] + len(d))
+            part_offsets.append(len(lengths))
+        clue_offsets.append(len(directions))
+
+    arrays = {
+        "numbers": np.array([r.number for r in records], dtype="<i4"),
+        "dates": np.array([NO_DATE if r.date is None else (r.date - EPOCH) // dt.timedelta(seconds=1) for r in records],
+                          dtype="<i8"),
+        "shapes": np.array([np.shape(r.mask) for r in records], dtype="<u2").reshape(-1, 2),
+        "cell_offsets": np.array(cell_offsets, dtype="<i8"),
+        "mask": np.concatenate(masks) if masks else np.zeros(0, dtype="u1"),
+        "cell_numbers": (np.concatenate(cell_numbers) if cell_numbers else np.zeros(0)).astype("<u2"),
+        "clue_offsets": np.array(clue_offsets, dtype="<i8"),
+        "directions": np.array(directions, dtype="u1"),
+        # Offsets are in characters, as the strings are decoded all at once
+        "string_offsets": np.array(string_offsets, dtype="<i8"),
+        "strings": np.frombuffer("".join(strings).encode("utf-8"), dtype="u1"),
+        "part_offsets": np.array(part_offsets, dtype="<i8"),
+        "lengths": np.array(lengths, dtype="<u2"),
+        "delimiter_offsets": np.array(delimiter_offsets, dtype="<i8"),
+        "delimiters": np.frombuffer("".join(delimiters).encode("utf-8"), dtype="u1"),
+    }
+
+    layout = dict()
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header = json.dumps({"version": VERSION, "arrays": layout}).encode("utf-8")
+    start = -(-(len(MAGIC) + 4 + len(header)) // ALIGN) * ALIGN
+
+    path = Path(path)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as file:
+        file.write(MAGIC + len(header).to_bytes(4, "little") + header)
+        for name, array in arrays.items():
+            file.seek(start + layout[name]["offset"])
+            file.write(array.tobytes())
+        file.truncate(start + offset)
+    os.replace(tmp, path)
+
+
+class PuzzleArchive:
+    """
+    Read-only view of a file written by write_archive. The file is memory-mapped and every field
+    is a view into it, so opening an archive of thousands of puzzles reads only the header, and a
+    puzzle is only pulled off the disk when it is looked up. A missing file is an empty archive.
+    Records are copied out of the mapping, so they can be kept after the archive is closed.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.arrays = dict()
+        self.data = None
+        self._text = dict()
+        if not self.path.exists():
+            self.numbers = np.zeros(0, dtype="<i4")
+            return
+
+        with open(self.path, "rb") as file:
+            data = self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not a puzzle archive")
+        size = int.from_bytes(data[len(MAGIC):len(MAGIC) + 4], "little")
+        header = json.loads(data[len(MAGIC) + 4:len(MAGIC) + 4 + size])
+        if header["version"] != VERSION:
+            raise ValueError(f"{self.path} is version {header['version']} of the archive format, expected {VERSION}")
+        start = -(-(len(MAGIC) + 4 + size) // ALIGN) * ALIGN
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"], dtype=np.int64))
+            offset = start + spec["offset"]
+            # Plain arrays over the mapping rather than np.memmap, whose slicing is much slower
+            self.arrays[name] = np.frombuffer(data, dtype, count, offset).reshape(spec["shape"])
+        self.numbers = self.arrays["numbers"]
+
+    def close(self):
+        # The views into the mapping have to go before it can be closed
+        self.arrays = dict()
+        self.numbers = np.zeros(0, dtype="<i4")
+        self._text = dict()
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __contains__(self, number):
+        return self._position(number) is not None
+
+    def __iter__(self):
+        return (self.record(i) for i in range(len(self)))
+
+    def __getitem__(self, number):
+        i = self._position(number)
+        if i is None:
+            raise KeyError(number)
+        return self.record(i)
+
+    def _position(self, number):
+        # Numbers are written in order, so a binary search finds them
+        i = int(np.searchsorted(self.numbers, number))
+        return i if i < len(self.numbers) and self.numbers[i] == number else None
+
+    def text(self, name):
+        # A string array decoded once, as offsets into it are in characters
+        if name not in self._text:
+            self._text[name] = self.arrays[name].tobytes().decode("utf-8")
+        return self._text[name]
+
+    def record(self, i):
+        a = self.arrays
+        ny, nx = (int(n) for n in a["shapes"][i])
+        c0, c1 = a["cell_offsets"][i:i + 2]
+        k0, k1 = (int(k) for k in a["clue_offsets"][i:i + 2])
+        date = int(a["dates"][i])
+
+        text = self.text("strings")
+        bounds = a["string_offsets"][3*k0:3*k1 + 1].tolist()
+        strings = [text[bounds[j]:bounds[j+1]] for j in range(len(bounds) - 1)]
+        parts = a["part_offsets"][k0:k1 + 1].tolist()
+        directions = a["directions"][k0:k1].tolist()
+        # Slicing lists is much cheaper than slicing an array once per clue
+        all_lengths = a["lengths"][parts[0]:parts[-1]].tolist()
+        text = self.text("delimiters")
+        bounds = a["delimiter_offsets"][parts[0]:parts[-1] + 1].tolist()
+        all_delimiters = [text[bounds[j]:bounds[j+1]] for j in range(len(bounds) - 1)]
+        clues, lengths, delimiters = [], [], []
+        for j in range(k1 - k0):
+            p0, p1 = parts[j] - parts[0], parts[j+1] - parts[0]
+            clues.append((strings[3*j], DIRECTIONS[directions[j]], strings[3*j + 1], strings[3*j + 2]))
+            lengths.append(all_lengths[p0:p1])
+            delimiters.append(all_delimiters[p0:p1 - 1])
+
+        return PuzzleRecord(int(self.numbers[i]), None if date == NO_DATE else EPOCH + dt.timedelta(seconds=date),
+                            a["mask"][c0:c1].reshape(ny, nx).view(bool).copy(), a["cell_numbers"][c0:c1].reshape(ny, nx).copy(),
+                            clues, lengths, delimiters)
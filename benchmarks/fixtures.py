@@ -0,0 +1,170 @@
+"""
+Guardian pages for the benchmarks. Pages recorded from the live site with
+
+    python benchmarks/fixtures.py --from 16950 --number 10
+
+are saved under benchmarks/fixtures/pages/ and replayed as they are. Any other crossword number
+gets a synthetic page with the same markup and roughly the same size as the live one.
+"""
+import sys
+import random
+import argparse
+import datetime as dt
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+PAGES = FIXTURES / "pages"
+NEWS = FIXTURES / "news.json"
+
+# A known Monday to count publishing days (Monday to Saturday) from
+ANCHOR_NUMBER, ANCHOR_DATE = 17000, dt.date(2025, 1, 6)
+
+WORDS = ("about anger beach bread carol clear dance drama eagle early fancy flame grape green happy "
+         "heart ideal image jelly joint knife label lemon magic metal noble ocean opera paint piano "
+         "queen quiet radio river salad scale table tiger union urban vivid voice water whale yacht "
+         "young zebra").split()
+
+
+def publishing_date(number):
+    weeks, day = divmod(number - ANCHOR_NUMBER, 6)
+    return ANCHOR_DATE + dt.timedelta(weeks=weeks, days=day)
+
+
+def synthetic_grid(number, size=13):
+    """
+    A 13x13 grid in the usual British style: white cells wherever the row or column is even,
+    with some runs split by black squares, keeping the grid symmetric under a half turn.
+
+    Returns:
+        Set of (x, y) white cells.
+    """
+    rng = random.Random(number)
+    white = {(x, y) for y in range(size) for x in range(size) if x % 2 == 0 or y % 2 == 0}
+    for line in range(0, size // 2 + 1, 2):
+        for across in (True, False):
+            if rng.random() < 0.7:
+                split = rng.choice((3, 5, 7, 9))
+                cell = (split, line) if across else (line, split)
+                white.discard(cell)
+                white.discard((size - 1 - cell[0], size - 1 - cell[1]))
+    return white
+
+
+def number_grid(white, size=13):
+    # Standard numbering, returning {(x, y): number} and the (number, direction, length) of every light
+    numbers, lights = dict(), []
+    n = 0
+    for y in range(size):
+        for x in range(size):
+            if (x, y) not in white:
+                continue
+            runs = []
+            for direction, (dx, dy) in (("across", (1, 0)), ("down", (0, 1))):
+                if (x - dx, y - dy) in white:
+                    continue
+                length = 0
+                while (x + length*dx, y + length*dy) in white:
+                    length += 1
+                if length > 1:
+                    runs.append((direction, length))
+            if runs:
+                n += 1
+                numbers[(x, y)] = n
+                lights.extend((n, direction, length) for direction, length in runs)
+    return numbers, lights
+
+
+def enumeration(length, rng):
+    # Answer lengths like (9), (4,5) or (4-5)
+    if length < 6 or rng.random() < 0.6:
+        return f"({length})"
+    first = rng.randint(3, length - 3)
+    return f"({first}{rng.choice(',-')}{length - first})"
+
+
+def filler(kilobytes, rng):
+    # Navigation, scripts and styles that the parser has to wade through on the live pages
+    blocks, size = [], 0
+    while size < kilobytes * 1024:
+        words = " ".join(rng.choices(WORDS, k=40))
+        block = (f'<div class="dcr-{rng.randrange(16**6):06x}"><ul><li><a href="/{rng.choice(WORDS)}">{words[:30]}</a></li>'
+                 f'<li><a href="/{rng.choice(WORDS)}">{words[30:60]}</a></li></ul><p>{words}</p>'
+                 f'<script type="application/json">{{"id": {rng.randrange(10**9)}, "text": "{words}"}}</script></div>\n')
+        blocks.append(block)
+        size += len(block)
+    return "".join(blocks)
+
+
+def synthetic_print_html(number, cell=30):
+    rng = random.Random(f"print:{number}")
+    white = synthetic_grid(number)
+    numbers, lights = number_grid(white)
+
+    cells = []
+    for y in range(13):
+        for x in range(13):
+            if (x, y) not in white:
+                continue
+            rect = f'<rect x="{x*cell}" y="{y*cell}" width="{cell}" height="{cell}"></rect>'
+            if (x, y) in numbers:
+                cells.append(f'<g>{rect}<text x="{x*cell + 1}" y="{y*cell + 9}">{numbers[(x, y)]}</text></g>')
+            else:
+                cells.append(rect)
+
+    clues = {"across": [], "down": []}
+    for n, direction, length in lights:
+        text = " ".join(rng.choices(WORDS, k=rng.randint(2, 6))).capitalize()
+        clues[direction].append(f'<li><span class="printable-crossword__clue__number">{n}</span>'
+                                f'<span>{text} {enumeration(length, rng)}</span></li>')
+
+    lists = "".join(f'<div class="printable-crossword__clues"><h3>{direction.capitalize()}</h3><ol>{"".join(items)}</ol></div>'
+                    for direction, items in clues.items())
+    return (f'<!DOCTYPE html><html><head><title>Quick crossword No {number:,} | The Guardian</title>'
+            f'<style>{filler(15, rng)}</style></head><body>{filler(20, rng)}'
+            f'<div class="printable-crossword"><h1>Quick crossword No {number:,}</h1>'
+            f'<svg viewBox="0 0 {13*cell} {13*cell}" class="crossword__grid"><g class="cells">{"".join(cells)}</g></svg>'
+            f'{lists}</div></body></html>')
+
+
+def synthetic_web_html(number):
+    rng = random.Random(f"web:{number}")
+    date = publishing_date(number).strftime("%a %d %b %Y")
+    return (f'<!DOCTYPE html><html><head><title>Quick crossword No {number:,}</title>'
+            f'<script>window.guardian = {{"config": "{filler(100, rng)[:100_000]!r}"}}</script></head>'
+            f'<body>{filler(200, rng)}<div data-gu-name="dateline"><details><summary>'
+            f'<span class="dcr-u0h1qy">{date} 00.00 GMT</span></summary></details></div>'
+            f'{filler(150, rng)}</body></html>')
+
+
+def print_html(number):
+    path = PAGES / str(number) / "print.html"
+    return path.read_text(encoding="utf-8") if path.exists() else synthetic_print_html(number)
+
+
+def web_html(number):
+    path = PAGES / str(number) / "web.html"
+    return path.read_text(encoding="utf-8") if path.exists() else synthetic_web_html(number)
+
+
+def record(numbers):
+    # Save the live pages so that benchmark runs replay real markup
+    from fetch import Fetcher, print_url, web_url
+    fetcher = Fetcher()
+    for number in numbers:
+        folder = PAGES / str(number)
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / "print.html").write_text(fetcher.get(print_url(number)), encoding="utf-8")
+        (folder / "web.html").write_text(fetcher.get(web_url(number)), encoding="utf-8")
+        print(f"Recorded #{number}")
+    fetcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record Guardian pages for the benchmarks.")
+    parser.add_argument("--from", type=int, dest="from_", required=True, help="First crossword number to record")
+    parser.add_argument("--number", type=int, default=1, help="Number of crosswords to record")
+    args = parser.parse_args()
+    record(range(args.from_, args.from_ + args.number))
@@ -0,0 +1,264 @@
+"""
+Offline benchmark suite. Every page comes from the fixtures (see fixtures.py) and every headline
+from fixtures/news.json, so no run touches theguardian.com or Google News.
+
+    python benchmarks/run.py --out results.json
+    python benchmarks/run.py --out new.json --compare results.json --only parse wordart
+
+Results are written as JSON with the median, minimum and mean time of each benchmark, together
+with the commit and machine they were measured on.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import datetime as dt
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+CWD = Path.cwd()
+sys.path.insert(0, str(ROOT))
+# main.py loads its fonts relative to the working directory
+os.chdir(ROOT)
+
+import main
+import archive
+import wordart
+import fixtures
+from server import StandInServer
+
+
+FONT = ROOT / "fonts" / "GHGuardianHeadline-Bold.ttf"
+NUMBER = fixtures.ANCHOR_NUMBER
+GROUPS = ("parse", "grid", "wordart", "page", "archive", "fetch", "build")
+
+
+class Suite:
+    def __init__(self, repeats=10):
+        self.repeats = repeats
+        self.results = []
+
+    def bench(self, group, name, func, setup=None, repeats=None, **params):
+        # Time func(setup()) repeatedly, leaving the setup out of the timings
+        times = []
+        for i in range(repeats or self.repeats):
+            arg = setup(i) if setup is not None else None
+            start = time.perf_counter()
+            func(arg)
+            times.append(time.perf_counter() - start)
+        times = np.array(times)
+        result = {"group": group, "name": name, "params": params, "repeats": len(times),
+                  "median": float(np.median(times)), "min": float(times.min()), "mean": float(times.mean())}
+        self.results.append(result)
+        label = name + "".join(f" {k}={v}" for k, v in params.items())
+        print(f"{group:<8} {label:<52} {result['median']*1000:>10.2f}ms {result['min']*1000:>10.2f}ms")
+
+
+def soup(html):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, features="html.parser")
+
+
+def fixture_puzzle(number=NUMBER):
+    puzzle = main.Puzzle.from_guardian_html(number, fixtures.print_html(number), fixtures.web_html(number))
+    with open(fixtures.NEWS, encoding="utf-8") as file:
+        puzzle.headlines = json.load(file)["default"]
+    puzzle.headline_weights = None
+    puzzle.fetch_latency = 0
+    return puzzle
+
+
+def bench_parse(suite):
+    print_html, web_html = fixtures.print_html(NUMBER), fixtures.web_html(NUMBER)
+    print_soup = soup(print_html)
+    a, d = print_soup.find_all(class_="printable-crossword__clues")
+    items = a.find_all("li") + d.find_all("li")
+    cells = print_soup.find(class_="cells").find_all(recursive=False)
+
+    suite.bench("parse", "print page soup", lambda _: soup(print_html))
+    suite.bench("parse", "web page soup", lambda _: soup(web_html))
+    suite.bench("parse", "Clue.from_guardian_soup", lambda _: [main.Clue.from_guardian_soup(tag, "across") for tag in items],
+                clues=len(items))
+    suite.bench("parse", "WhiteCell.from_guardian_soup", lambda _: [main.WhiteCell.from_guardian_soup(tag) for tag in cells],
+                cells=len(cells))
+    suite.bench("parse", "extract_guardian_parts", lambda _: main.extract_guardian_parts(print_html))
+    suite.bench("parse", "parse_dateline", lambda _: main.parse_dateline(web_html))
+    suite.bench("parse", "Puzzle.from_guardian_html", lambda _: main.Puzzle.from_guardian_html(NUMBER, print_html, web_html))
+
+
+def bench_grid(suite):
+    puzzle = fixture_puzzle()
+    clues = puzzle.across + puzzle.down
+    page = main.GuardianQuickCrossword()
+    page.add_page()
+    suite.bench("grid", "render_crossword_image",
+                lambda _: page.render_crossword_image(puzzle.white_cells, clues, puzzle.nx, puzzle.ny))
+    suite.bench("grid", "draw_crossword_grid",
+                lambda _: page.draw_crossword_grid(puzzle.white_cells, clues, puzzle.nx, puzzle.ny))
+
+
+def bench_wordart(suite, res=300):
+    def plain(_=None):
+        w = wordart.WordArt(str(NUMBER), res=res, fontpath=FONT)
+        w.set_colour((200, 30, 30))
+        return w
+
+    suite.bench("wordart", "text mask", lambda _: wordart.WordArt(str(NUMBER), res=res, fontpath=FONT), res=res)
+    for path, kwargs in (("sine", {"freq": 1, "amplitude": 0.15}), ("circle", {})):
+        follow = getattr(wordart, f"{path}_path")
+        suite.bench("wordart", "text mask on path",
+                    lambda _: wordart.WordArt(str(NUMBER), res=res, fontpath=FONT, follow_path=follow, path_kwargs=kwargs),
+                    res=res, path=path)
+    suite.bench("wordart", "set_colour", lambda w: w.set_colour((30, 200, 30)), setup=plain, res=res)
+    for direction in ("horizontal", "vertical", "radial", "diagonal"):
+        suite.bench("wordart", "add_gradient", lambda w: w.add_gradient("viridis", direction), setup=plain,
+                    res=res, direction=direction)
+    suite.bench("wordart", "extrude_text", lambda w: w.extrude_text(30, (0.6, 0.8), darken=0.5), setup=plain,
+                res=res, colouring="darken")
+    suite.bench("wordart", "extrude_text", lambda w: w.extrude_text(30, (0.6, 0.8), colour=(20, 20, 120)), setup=plain,
+                res=res, colouring="colour")
+    for quality in (1, 0.5, 0.25):
+        suite.bench("wordart", "add_drop_shadow", lambda w: w.add_drop_shadow((30, -40), 8, (20, 0, 60), quality=quality),
+                    setup=plain, res=res, quality=quality)
+        suite.bench("wordart", "add_perspective_shadow",
+                    lambda w: w.add_perspective_shadow(1.2, 0.8, (10, 10, 10), 4, quality=quality),
+                    setup=plain, res=res, quality=quality)
+    suite.bench("wordart", "perspective_transform", lambda w: w.perspective_transform(), setup=plain, res=res)
+    # A different seed each time, so this averages over the fonts and effects randomise picks
+    suite.bench("wordart", "randomise", lambda seed: wordart.WordArt.randomise(str(NUMBER), seed=seed, res=res),
+                setup=lambda i: i, res=res)
+
+
+def bench_page(suite):
+    puzzle = fixture_puzzle()
+    for vector_grid in (True, False):
+        suite.bench("page", "render_single_page", lambda _: main.render_single_page(puzzle, vector_grid=vector_grid, seed=1),
+                    vector_grid=vector_grid)
+    suite.bench("page", "render_page_content", lambda _: main.render_page_content(puzzle, seed=1))
+
+
+def bench_archive(suite, puzzles=312):
+    # A year of puzzles, written to an archive and loaded back for re-rendering
+    puzzle = fixture_puzzle()
+    records = []
+    for number in range(NUMBER, NUMBER + puzzles):
+        record = puzzle.to_record()
+        record.number = number
+        records.append(record)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "puzzles.gqpa"
+        suite.bench("archive", "write_archive", lambda _: archive.write_archive(path, records), puzzles=puzzles)
+        suite.bench("archive", "PuzzleArchive", lambda _: archive.PuzzleArchive(path).close(), puzzles=puzzles)
+
+        def load(_):
+            with archive.PuzzleArchive(path) as puzzles_file:
+                return [main.Puzzle.from_record(record) for record in puzzles_file]
+        suite.bench("archive", "Puzzle.from_record", load, puzzles=puzzles)
+
+
+def bench_fetch(suite, latency, pages=100, threads=32):
+    # Print pages through the adaptive scheduler, from a site that is healthy and from one that throttles and fails
+    from concurrent.futures import ThreadPoolExecutor
+    from fetch import Fetcher
+    from scheduler import HostScheduler, RetryPolicy
+
+    for capacity, error_rate in ((None, 0), (8, 0.05)):
+        with StandInServer(latency=latency, capacity=capacity, error_rate=error_rate) as server:
+            def fetch_all(_):
+                scheduler = HostScheduler(threads, retry_policy=RetryPolicy(10, backoff=0.1))
+                fetcher = Fetcher(pool_size=threads, scheduler=scheduler, timeout=10)
+                with ThreadPoolExecutor(threads) as executor:
+                    list(executor.map(lambda n: fetcher.get(server.url.format(number=n) + "/print"),
+                                      range(NUMBER, NUMBER + pages)))
+                fetcher.close()
+
+            suite.bench("fetch", "Fetcher.get", fetch_all, repeats=3, pages=pages, capacity=capacity,
+                        error_rate=error_rate, latency=latency)
+
+
+def bench_build(suite, sizes, repeats, latency):
+    # Whole runs of main.py against the stand-in, from a cold cache, as a user would start them
+    with StandInServer(latency=latency) as server, tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, GUARDIAN_URL=server.url)
+
+        def build(number, options):
+            cache = tempfile.mkdtemp(dir=tmp)
+            subprocess.run([sys.executable, "main.py", "--from", str(NUMBER), "--number", str(number),
+                            "--out", tmp, "--cache-dir", cache, "--news-fixture", str(fixtures.NEWS), *options],
+                           env=env, check=True, stdout=subprocess.DEVNULL)
+
+        for number in sizes:
+            for single_document in (False, True):
+                options = ["--single-document"] if single_document else []
+                suite.bench("build", "main.py", lambda _: build(number, options), repeats=repeats,
+                            number=number, single_document=single_document, latency=latency)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold=1.1):
+    # Ratio of each median to the baseline's, flagging anything more than threshold times slower
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = {(r["group"], r["name"], json.dumps(r["params"], sort_keys=True)): r
+                    for r in json.load(file)["results"]}
+    print(f"\nCompared with {baseline_path}")
+    for r in results:
+        old = baseline.get((r["group"], r["name"], json.dumps(r["params"], sort_keys=True)))
+        if old is None:
+            continue
+        ratio = r["median"] / old["median"]
+        flag = "  SLOWER" if ratio > threshold else ""
+        label = r["name"] + "".join(f" {k}={v}" for k, v in r["params"].items())
+        print(f"{r['group']:<8} {label:<52} {ratio:>7.2f}x{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks.")
+    parser.add_argument("--out", default=ROOT / "cache" / "benchmarks" / "results.json", help="JSON file to write the results to (default cache/benchmarks/results.json)")
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=GROUPS, help="Only run these groups")
+    parser.add_argument("--repeats", type=int, default=10, help="Repeats of each micro benchmark (default 10)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 16], help="--number values for the full builds (default 1 4 16)")
+    parser.add_argument("--build-repeats", type=int, default=3, help="Repeats of each full build (default 3)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated network round trip of the stand-in in seconds (default 0.05)")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    args = parser.parse_args()
+    out = CWD / args.out
+
+    suite = Suite(args.repeats)
+    print(f"{'group':<8} {'benchmark':<52} {'median':>12} {'min':>12}")
+    if "parse" in args.only:
+        bench_parse(suite)
+    if "grid" in args.only:
+        bench_grid(suite)
+    if "wordart" in args.only:
+        bench_wordart(suite)
+    if "page" in args.only:
+        bench_page(suite)
+    if "archive" in args.only:
+        bench_archive(suite)
+    if "fetch" in args.only:
+        bench_fetch(suite, args.latency)
+    if "build" in args.only:
+        bench_build(suite, args.sizes, args.build_repeats, args.latency)
+
+    meta = {"time": dt.datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as file:
+        json.dump({"meta": meta, "results": suite.results}, file, indent=2)
+    print(f"The results are at {out}")
+
+    if args.compare:
+        compare(suite.results, CWD / args.compare)
@@ -0,0 +1,101 @@
+"""
+Local stand-in for theguardian.com that serves the benchmark fixtures. Point the generator at it
+with the GUARDIAN_URL environment variable, eg.
+
+    python benchmarks/server.py --port 8765
+    GUARDIAN_URL=http://127.0.0.1:8765/crosswords/quick/{number} python main.py ...
+"""
+import re
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import fixtures
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        match = re.match(r"/crosswords/quick/(\d+)(/print)?$", self.path)
+        if match is None:
+            self.send_error(404)
+            return
+
+        server = self.server
+        with server.lock:
+            server.active += 1
+            busy = server.capacity is not None and server.active > server.capacity
+        try:
+            self.respond(int(match[1]), match[2], busy)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def respond(self, number, print_page, busy):
+        etag = f'"{number}{print_page or ""}"'
+        # Simulated round trip to the real site, which slows down as it gets busier
+        time.sleep(self.server.latency * (1 + self.server.active / 10))
+        if busy:
+            # Over capacity, so throttle the client the way a real site would
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            return
+        if random.random() < self.server.error_rate:
+            self.send_error(503)
+            return
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = (fixtures.print_html(number) if print_page else fixtures.web_html(number)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer:
+    """
+    Serves the fixtures from a background thread, on a free port unless one is given.
+    Use as a context manager; url is the GUARDIAN_URL template for it.
+
+    To test how the fetcher copes with a struggling site, requests beyond capacity at once get a
+    429 with Retry-After, and error_rate of the others get a 503.
+    """
+    def __init__(self, port=0, latency=0, capacity=None, error_rate=0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), StandInHandler)
+        self.httpd.latency = latency
+        self.httpd.capacity = capacity
+        self.httpd.error_rate = error_rate
+        self.httpd.active = 0
+        self.httpd.lock = threading.Lock()
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/crosswords/quick/{{number}}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the benchmark fixtures in place of theguardian.com.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default 8765)")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds to wait before answering each request")
+    parser.add_argument("--capacity", type=int, default=None, help="Requests at once before answering 429 Too Many Requests")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests to answer with 503 Service Unavailable")
+    args = parser.parse_args()
+    with StandInServer(args.port, args.latency, args.capacity, args.error_rate) as server:
+        print(f"Serving on GUARDIAN_URL={server.url}")
+        threading.Event().wait()
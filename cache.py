@@ -0,0 +1,130 @@
+import os
+import json
+import threading
+import hashlib
+from pathlib import Path
+
+
+class DiskCache:
+    """
+    Directory of cached files with a size cap. Entries are evicted least recently used first,
+    using the file modification time as the access time.
+    The size of the directory is kept as a running total, so the directory is only scanned when the
+    total goes over the cap, or every max_bytes/8 written to pick up other processes' entries.
+    Eviction goes down to 7/8 of the cap, so that a full cache is not scanned on every write.
+    """
+    def __init__(self, directory, max_bytes=500*1024**2):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.total = None
+        self.written = 0
+        self.lock = threading.Lock()
+
+    def path(self, *key):
+        return self.directory.joinpath(*map(str, key))
+
+    def read(self, *key):
+        path = self.path(*key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return data
+
+    def write(self, data, *key):
+        path = self.path(*key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so that other workers never read a half-written entry
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp, path)
+
+        with self.lock:
+            if self.total is None:
+                self.evict()
+                return
+            self.total += len(data) - replaced
+            self.written += len(data)
+            if self.total > self.max_bytes or self.written > self.max_bytes / 8:
+                self.evict()
+
+    def evict(self):
+        # Scan the whole directory, evict if over the cap and start the running total again from what is left
+        entries = []
+        for path in self.directory.rglob("*"):
+            if path.is_file() and not path.name.endswith(".tmp"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes if total <= self.max_bytes else self.max_bytes * 7 // 8
+        for _, _, path in sorted(entries):
+            if total <= target:
+                break
+            total -= self._remove(path)
+        self.total = total
+        self.written = 0
+
+    def _remove(self, path):
+        # Returns the bytes freed
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return 0
+        return size
+
+
+class CachedResponse:
+    def __init__(self, text, etag=None, last_modified=None):
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def validators(self):
+        headers = dict()
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache(DiskCache):
+    """
+    Cache of Guardian pages keyed by crossword number and URL. Each response body is stored
+    alongside a small JSON file holding its ETag/Last-Modified validators.
+    """
+    def _key(self, number, url):
+        return str(number), hashlib.sha1(url.encode()).hexdigest()[:16]
+
+    def get(self, number, url):
+        folder, name = self._key(number, url)
+        body = self.read(folder, name + ".html")
+        if body is None:
+            return None
+        meta = self.read(folder, name + ".json")
+        meta = json.loads(meta) if meta is not None else dict()
+        return CachedResponse(body.decode(), meta.get("etag"), meta.get("last_modified"))
+
+    def put(self, number, url, text, etag=None, last_modified=None):
+        folder, name = self._key(number, url)
+        meta = {"url": url, "etag": etag, "last_modified": last_modified}
+        self.write(json.dumps(meta).encode(), folder, name + ".json")
+        self.write(text.encode(), folder, name + ".html")
+
+    def _remove(self, path):
+        # A body is useless without its validators and vice versa, so evict them together
+        freed = 0
+        for p in (path.with_suffix(".html"), path.with_suffix(".json")):
+            freed += super()._remove(p)
+        return freed
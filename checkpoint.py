@@ -0,0 +1,74 @@
+import io
+import os
+import json
+import pickle
+import shutil
+from pathlib import Path
+
+
+class Checkpoint:
+    """
+    Working directory for a run. Every page is saved as soon as it is finished, and a manifest
+    records which pages are done and which failed (and why), so rerunning the same range only
+    builds the pages that are missing.
+    Pages are kept as PDFs, or as pickled PageContents for --single-document. If the page options
+    differ from the ones the directory was started with, its pages are thrown away.
+    """
+    def __init__(self, directory, options):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.directory / "manifest.json"
+        # Round trip through JSON so that the options compare equal to the saved ones
+        self.options = json.loads(json.dumps(options, default=str))
+
+        manifest = dict()
+        if self.manifest_path.exists():
+            with open(self.manifest_path, encoding="utf-8") as file:
+                manifest = json.load(file)
+        if manifest.get("options") != self.options:
+            self.clear()
+            manifest = dict()
+        self.pages = manifest.get("pages", dict())
+        self.failed = manifest.get("failed", dict())
+
+    def done(self, number):
+        return str(number) in self.pages and (self.directory / self.pages[str(number)]).exists()
+
+    def save(self, number, page):
+        if isinstance(page, io.BytesIO):
+            name, data = f"{number}.pdf", page.getvalue()
+        else:
+            # Only ever read back from our own working directory
+            name, data = f"{number}.pickle", pickle.dumps(page)
+        path = self.directory / name
+        tmp = path.with_name(f"{name}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        self.pages[str(number)] = name
+        self.failed.pop(str(number), None)
+        self._write_manifest()
+
+    def fail(self, number, error):
+        self.failed[str(number)] = f"{type(error).__name__}: {error}"
+        self._write_manifest()
+
+    def load(self, number):
+        path = self.directory / self.pages[str(number)]
+        if path.suffix == ".pdf":
+            return io.BytesIO(path.read_bytes())
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
+    def clear(self):
+        for path in self.directory.iterdir():
+            if path.is_file():
+                path.unlink()
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _write_manifest(self):
+        tmp = self.manifest_path.with_name("manifest.json.tmp")
+        tmp.write_text(json.dumps({"options": self.options, "pages": self.pages, "failed": self.failed}, indent=1),
+                       encoding="utf-8")
+        os.replace(tmp, self.manifest_path)
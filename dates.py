@@ -0,0 +1,163 @@
+import os
+import json
+import bisect
+import threading
+import datetime as dt
+from pathlib import Path
+
+
+def is_publishing_day(date):
+    # The Quick crossword is in the paper Monday to Saturday, except on Christmas Day
+    return date.weekday() < 6 and (date.month, date.day) != (12, 25)
+
+
+def publishing_days(start, end):
+    # Publishing days after start, up to and including end. Every week has six, less any Christmas Days
+    first, last = start.toordinal(), end.toordinal()
+    weeks, rest = divmod(last - first, 7)
+    # Ordinal 1 is a Monday, so (ordinal - 1) % 7 is the weekday
+    count = 6*weeks + sum((first + k - 1) % 7 < 6 for k in range(1, rest + 1))
+    for year in range(start.year, end.year + 1):
+        christmas = dt.date(year, 12, 25)
+        if first < christmas.toordinal() <= last and christmas.weekday() < 6:
+            count -= 1
+    return count
+
+
+def advance(date, days):
+    # The date a given number of publishing days after (or before, if negative) date
+    if days == 0:
+        return date
+    step = dt.timedelta(days=1 if days > 0 else -1)
+    # Jump a week for every six days, then make up the Christmas Days skipped on the way
+    jumped = date + abs(days) // 6 * 7 * step
+    if days > 0:
+        remaining = days - publishing_days(date, jumped)
+    else:
+        remaining = -days - publishing_days(jumped - dt.timedelta(days=1), date - dt.timedelta(days=1))
+    if remaining == 0:
+        # Landed on a Sunday or Christmas Day past the last publishing day counted
+        while not is_publishing_day(jumped):
+            jumped -= step
+        return jumped
+    for _ in range(remaining):
+        jumped += step
+        while not is_publishing_day(jumped):
+            jumped += step
+    return jumped
+
+
+class DateIndex:
+    """
+    Publication dates of crosswords by number. Dates read off the Guardian's web pages are kept as
+    anchors, and the dates in between two anchors follow from the publishing schedule as long as
+    the anchors agree with it (ie. nothing was skipped between them). Numbers outside the anchors
+    are not guessed at, as the schedule could have a gap there.
+    """
+    def __init__(self, path=None):
+        self.path = Path(path) if path is not None else None
+        self.dates = dict()
+        self.numbers = []
+        # Whether the schedule joins up each pair of neighbouring anchors, checked once per pair
+        self.joined = dict()
+        self.lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if self.path is None or not self.path.exists():
+            return
+        with open(self.path, encoding="utf-8") as file:
+            for number, date in json.load(file).items():
+                self.dates[int(number)] = dt.datetime.fromisoformat(date)
+        self.numbers = sorted(self.dates)
+
+    def _save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Keep anchors other processes have saved since this index was loaded
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as file:
+                saved = {int(n): dt.datetime.fromisoformat(d) for n, d in json.load(file).items()}
+            for number, date in saved.items():
+                if number not in self.dates:
+                    self.dates[number] = date
+                    bisect.insort(self.numbers, number)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({str(n): d.isoformat() for n, d in sorted(self.dates.items())}), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def add(self, number, date):
+        with self.lock:
+            if self.dates.get(number) == date:
+                return
+            if number not in self.dates:
+                bisect.insort(self.numbers, number)
+            self.dates[number] = date
+            self.joined.clear()
+            self._save()
+
+    def lookup(self, number):
+        """
+        Returns:
+            The publication date of the crossword, or None if it cannot be worked out for certain.
+        """
+        with self.lock:
+            if number in self.dates:
+                return self.dates[number]
+            i = bisect.bisect(self.numbers, number)
+            if i == 0 or i == len(self.numbers):
+                return None
+            below, above = self.numbers[i-1], self.numbers[i]
+            # Only trust the schedule between anchors that it joins up exactly
+            if (below, above) not in self.joined:
+                self.joined[below, above] = publishing_days(self.dates[below], self.dates[above]) == above - below
+            if not self.joined[below, above]:
+                return None
+            return advance(self.dates[below], number - below)
+
+    def resolve(self, numbers, fetch_date):
+        """
+        Look up a whole range of numbers at once. Dates that cannot be worked out are filled in by
+        fetching the dates of the range's ends with fetch_date(number), then splitting the range
+        in half wherever the schedule does not join the two ends up, so a range with no gaps in
+        the schedule costs two fetches however long it is.
+
+        Returns:
+            Dict of number to date, or None where it still could not be found.
+        """
+        numbers = sorted(set(numbers))
+        missing = [n for n in numbers if self.lookup(n) is None]
+        if missing:
+            self._fill(missing[0], missing[-1], fetch_date)
+        return {n: self.lookup(n) for n in numbers}
+
+    def _fill(self, lo, hi, fetch_date):
+        for number in {lo, hi}:
+            if number not in self.dates:
+                try:
+                    self.add(number, fetch_date(number))
+                except Exception:
+                    # Left for the page fetch to retry and report
+                    return
+        if hi - lo > 1 and any(self.lookup(n) is None for n in range(lo + 1, hi)):
+            mid = (lo + hi) // 2
+            self._fill(lo, mid, fetch_date)
+            self._fill(mid, hi, fetch_date)
+
+
+_index = None
+_index_path = None
+
+
+def configure_date_index(cache_dir=None):
+    global _index, _index_path
+    _index_path = Path(cache_dir) / "dates.json" if cache_dir is not None else None
+    _index = None
+
+
+def get_date_index():
+    global _index
+    if _index is None:
+        _index = DateIndex(_index_path)
+    return _index
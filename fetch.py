@@ -0,0 +1,129 @@
+import os
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import ResponseCache
+from scheduler import RETRY_STATUSES, RetryableError, get_scheduler, get_timeout
+
+
+# Can be pointed at a local stand-in, as the benchmarks do
+GUARDIAN_URL = os.environ.get("GUARDIAN_URL", "https://www.theguardian.com/crosswords/quick/{number}")
+
+
+def web_url(number):
+    return GUARDIAN_URL.format(number=number)
+
+
+def print_url(number):
+    return web_url(number) + "/print"
+
+
+class OfflineError(LookupError):
+    pass
+
+
+class TimedSession(requests.Session):
+    """
+    Session that gives every request a timeout and raises RetryableError on the responses that mean
+    "try again later", so that libraries making their own requests (eg. the Google News feed) can
+    neither hang nor hide a throttled request from the scheduler.
+    """
+    def __init__(self, timeout=30):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        resp = super().request(method, url, **kwargs)
+        if resp.status_code in RETRY_STATUSES:
+            raise RetryableError(f"{resp.status_code} from {url}", resp.headers.get("Retry-After"))
+        return resp
+
+
+class Fetcher:
+    def __init__(self, pool_size=16, cache=None, offline=False, scheduler=None, timeout=30):
+        # One keep-alive session so repeat requests to the Guardian reuse connections
+        self.session = TimedSession(timeout)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Only ever runs the web page requests, so every fetch thread can have one in flight
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        self.cache = cache
+        self.offline = offline
+        self.scheduler = scheduler
+        self.pid = os.getpid()
+
+    def get(self, url, number=None):
+        cached = self.cache.get(number, url) if self.cache is not None else None
+        if self.offline:
+            if cached is None:
+                raise OfflineError(f"{url} is not in the cache and --offline was given")
+            return cached.text
+
+        # Revalidate cached pages rather than downloading them again
+        headers = cached.validators() if cached is not None else dict()
+        if self.scheduler is not None:
+            resp = self.scheduler.run(urlsplit(url).netloc, lambda: self.request(url, headers))
+        else:
+            resp = self.request(url, headers)
+        if resp.status_code == 304 and cached is not None:
+            return cached.text
+
+        if resp.ok and self.cache is not None:
+            self.cache.put(number, url, resp.text, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+        return resp.text
+
+    def request(self, url, headers):
+        return self.session.get(url, headers=headers)
+
+    def fetch_crossword(self, number, web=True):
+        """
+        Fetch the print page and, if web is set, the web page for a crossword at the same time.
+
+        Returns:
+            (print_html, web_html, latency) where latency is the wall time in seconds for both requests.
+            web_html is None if web is not set.
+        """
+        start = time.perf_counter()
+        if not web:
+            return self.get(print_url(number), number), None, time.perf_counter() - start
+        # The print page is fetched in the calling thread while the web page is fetched alongside it
+        web_page = self.executor.submit(self.get, web_url(number), number)
+        print_html = self.get(print_url(number), number)
+        web_html = web_page.result()
+        return print_html, web_html, time.perf_counter() - start
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+
+_fetcher = None
+_fetcher_settings = dict()
+
+
+def configure_fetcher(cache_dir=None, cache_size=None, offline=False):
+    # Called in the main process and as the pool initialiser so every worker shares the same settings
+    global _fetcher
+    _fetcher_settings.update(cache_dir=cache_dir, cache_size=cache_size, offline=offline)
+    _fetcher = None
+
+
+def get_fetcher():
+    # Sessions must not be shared across processes, so each pool worker lazily builds its own
+    global _fetcher
+    if _fetcher is None or _fetcher.pid != os.getpid():
+        cache_dir = _fetcher_settings.get("cache_dir")
+        cache = None
+        if cache_dir is not None:
+            cache = ResponseCache(Path(cache_dir) / "pages", max_bytes=_fetcher_settings["cache_size"])
+        scheduler = get_scheduler()
+        _fetcher = Fetcher(pool_size=scheduler.max_connections, cache=cache, offline=_fetcher_settings.get("offline", False),
+                           scheduler=scheduler, timeout=get_timeout())
+    return _fetcher
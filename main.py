@@ -2,27 +2,32 @@ import re
 import os
 import io
 import sys
-import random
+import queue
 import argparse
+import threading
 import datetime as dt
 from pathlib import Path
 from functools import partial
-from multiprocessing import Pool, Manager, cpu_count
+from multiprocessing import Pool, cpu_count
 
 import fpdf
-import pypdf
 import qrcode
-import requests
 import numpy as np
-from bs4 import BeautifulSoup
-from PIL import Image, ImageDraw, ImageFont
-from google_news_feed import GoogleNewsFeed
-from nltk.sentiment import SentimentIntensityAnalyzer
+from PIL import Image, ImageDraw, ImageFont, ImageMode
 
 import wordart
+import profiling
+from archive import PuzzleArchive, PuzzleRecord, write_archive
+from checkpoint import Checkpoint
+from dates import configure_date_index, get_date_index
+from fetch import configure_fetcher, get_fetcher, web_url
+from scheduler import configure_scheduler
+from news import configure_headlines, ensure_vader_lexicon, get_headline_provider, get_sia, headline_weights, pick_headline
 
 
 class WhiteCell:
+    __slots__ = ("x", "y", "clue_number")
+
     def __init__(self, x, y, clue_number):
         self.x = x
         self.y = y
@@ -46,11 +51,18 @@ class WhiteCell:
 
 
 class Clue:
-    def __init__(self, number, direction, text, num_letters):
+    __slots__ = ("number", "direction", "text", "num_letters", "lengths", "delimiters")
+
+    def __init__(self, number, direction, text, num_letters, lengths=None, delimiters=None):
         self.number = number
         self.direction = direction
         self.text = text
         self.num_letters = num_letters
+        # Parsed once here rather than on every render
+        if lengths is None:
+            lengths, delimiters = parse_enumeration(num_letters)
+        self.lengths = lengths
+        self.delimiters = delimiters
 
     def __repr__(self):
         return f"<Clue {self.number} {self.direction}: {self.text} {self.num_letters}>"
@@ -77,17 +89,326 @@ class Clue:
         multiword = "," in self.num_letters or "-" in self.num_letters
         if not multiword:
             return False
-        x = self.num_letters.replace("(", "").replace(")", "")
-        numbers = list(map(int, re.findall(r'\d+', x)))
-        delimiters = re.findall(r'[^\d]+', x)
-        return numbers, delimiters
+        return self.lengths, self.delimiters
+
+
+def parse_enumeration(num_letters):
+    # "(6,3-4)" -> [6, 3, 4], [",", "-"]
+    x = num_letters.replace("(", "").replace(")", "")
+    return list(map(int, re.findall(r'\d+', x))), re.findall(r'[^\d]+', x)
+
+
+class Puzzle:
+    """
+    A parsed crossword. The grid is kept as arrays indexed [y, x]: mask marks the white cells and
+    cell_numbers holds the clue number printed in each one (0 for none). The WhiteCells and word
+    breaks the renderers draw from are worked out from them once, when first needed.
+    """
+    __slots__ = ("number", "date", "across", "down", "mask", "cell_numbers", "headlines", "headline_weights",
+                 "fetch_latency", "_white_cells", "_breaks")
+
+    def __init__(self, number, date, across, down, mask, cell_numbers):
+        self.number = number
+        self.date = date
+        self.across = across
+        self.down = down
+        self.mask = mask
+        self.cell_numbers = cell_numbers
+        self.headlines = None
+        self.headline_weights = None
+        self.fetch_latency = None
+        self._white_cells = None
+        self._breaks = None
+
+    @property
+    def nx(self):
+        return self.mask.shape[1]
+
+    @property
+    def ny(self):
+        return self.mask.shape[0]
+
+    @property
+    def white_cells(self):
+        if self._white_cells is None:
+            ys, xs = np.nonzero(self.mask)
+            numbers = self.cell_numbers[ys, xs]
+            self._white_cells = [WhiteCell(x, y, str(n) if n else "") for x, y, n in zip(xs.tolist(), ys.tolist(), numbers.tolist())]
+        return self._white_cells
+
+    @property
+    def breaks(self):
+        if self._breaks is None:
+            self._breaks = grid_breaks(self.white_cells, self.across + self.down)
+        return self._breaks
+
+    @classmethod
+    def from_cells(cls, number, date, across, down, white_cells, nx=13, ny=13):
+        mask = np.zeros((ny, nx), dtype=bool)
+        cell_numbers = np.zeros((ny, nx), dtype=np.uint16)
+        for cell in white_cells:
+            mask[cell.y, cell.x] = True
+            if cell.clue_number.isdigit():
+                cell_numbers[cell.y, cell.x] = int(cell.clue_number)
+        return cls(number, date, across, down, mask, cell_numbers)
+
+    def to_record(self):
+        clues = self.across + self.down
+        return PuzzleRecord(self.number, self.date, self.mask, self.cell_numbers,
+                            [(c.number, c.direction, c.text, c.num_letters) for c in clues],
+                            [c.lengths for c in clues], [c.delimiters for c in clues])
+
+    @classmethod
+    def from_record(cls, record):
+        clues = [Clue(*clue, list(lengths), list(delimiters))
+                 for clue, lengths, delimiters in zip(record.clues, record.lengths, record.delimiters)]
+        return cls(record.number, record.date, [c for c in clues if c.direction == "across"],
+                   [c for c in clues if c.direction == "down"], record.mask, record.cell_numbers)
+
+    @classmethod
+    def from_guardian_html(cls, number, print_html, web_html=None, date=None):
+        # The web page is only needed for the date, when it is not already known
+        if date is None:
+            date = parse_dateline(web_html)
+
+        parts = extract_guardian_parts(print_html)
+        if parts is not None:
+            try:
+                return cls.from_guardian_parts(number, *parts, date)
+            except (AttributeError, ValueError, KeyError):
+                pass
+
+        # The markup has changed in a way the targeted parse misses, so go through the whole page.
+        # Parsing only happens in the main process, so render workers never import bs4
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(print_html, features="html.parser")
+        return cls.from_guardian_parts(number, soup.find_all(class_="printable-crossword__clues"), soup.find(class_="cells"), date)
+
+    @classmethod
+    def from_guardian_parts(cls, number, clue_lists, cells, date):
+        # Extract clues
+        a, d = clue_lists
+        across_clues = [Clue.from_guardian_soup(tag, "across") for tag in a.find_all("li")]
+        down_clues = [Clue.from_guardian_soup(tag, "down") for tag in d.find_all("li")]
+
+        # Extract white cells 
+        white_cells = [WhiteCell.from_guardian_soup(x) for x in cells.find_all(recursive=False)]
+        nx, ny = grid_size(cells, white_cells)
+
+        return cls.from_cells(number, date, across_clues, down_clues, white_cells, nx, ny)
+
+
+def has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def parse_html(html):
+    # lxml tree of a page, or None if lxml is not installed or cannot read it
+    try:
+        import lxml.html
+    except ImportError:
+        return None
+    try:
+        return lxml.html.fromstring(html)
+    except (ValueError, lxml.etree.ParserError):
+        return None
+
+
+def fragment_soup(element):
+    import lxml.html
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(lxml.html.tostring(element, encoding="unicode"), features="lxml")
+
+
+def extract_guardian_parts(print_html):
+    """
+    Find the only parts of the print page a puzzle is made from (the two clue lists and the grid's
+    SVG) with lxml, which is much faster than building a bs4 tree of the whole page, and give bs4
+    just those fragments.
+
+    Returns:
+        (clue_lists, cells) as bs4 tags, or None if lxml is not installed or either part is missing.
+    """
+    page = parse_html(print_html)
+    if page is None:
+        return None
+    clue_lists = page.xpath(f"//*[{has_class('printable-crossword__clues')}]")
+    cells = page.xpath(f"//*[{has_class('cells')}]")
+    if len(clue_lists) != 2 or not cells:
+        return None
+    # Keep the SVG around the cells, as its viewBox gives the grid size
+    grid = cells[0].xpath("ancestor::svg[1]") or cells[:1]
+    return ([fragment_soup(e).find(class_="printable-crossword__clues") for e in clue_lists],
+            fragment_soup(grid[0]).find(class_="cells"))
+
+
+def parse_dateline(web_html):
+    # Scrape the web version for the date, looking at just the dateline if lxml can find it
+    page = parse_html(web_html)
+    dateline = page.xpath("//div[@data-gu-name='dateline']") if page is not None else []
+    if dateline:
+        text = dateline[0].text_content()
+    else:
+        from bs4 import BeautifulSoup
+        text = BeautifulSoup(web_html, features="html.parser").find("div", attrs={"data-gu-name": "dateline"}).text
+    return dt.datetime.strptime(" ".join(text.split()[:-1]), r"%a %d %b %Y %H.%M")
+
+
+def fetch_date(number):
+    # Only the web page has the date
+    return parse_dateline(get_fetcher().get(web_url(number), number))
+
+
+def grid_size(cells, white_cells):
+    # Read the grid dimensions from the SVG viewBox, making sure every white cell fits
+    nx = max(cell.x for cell in white_cells) + 1
+    ny = max(cell.y for cell in white_cells) + 1
+    svg = cells.find_parent("svg")
+    if svg is not None and svg.get("viewbox", svg.get("viewBox")):
+        _, _, width, height = map(float, svg.get("viewbox", svg.get("viewBox")).replace(",", " ").split())
+        rect = cells.find("rect")
+        s = int(rect["height"])
+        nx = max(nx, round(width / s))
+        ny = max(ny, round(height / s))
+    return nx, ny
+
+
+def grid_breaks(white_cells, clues):
+    """
+    Work out where the word breaks go in multi-word answers.
+
+    Returns:
+        List of (x0, y0, x1, y1) line segments in units of cells.
+    """
+    clue_map = {cell.clue_number: (cell.x, cell.y) for cell in white_cells if cell.is_clue_start()}
+    lines = []
+    for clue in clues:
+        if a := clue.get_multiword_lengths():
+            try:
+                x,y = clue_map[clue.number]
+            except:
+                # sometimes the guardian puts multiple clue numbers on one line. cant be bothered to parse that
+                continue
+
+            lengths, delims = a
+            cum_length = np.cumsum(lengths)
+            for d, c in zip(delims, cum_length):
+                if d == "-":
+                    if clue.direction == "across":
+                        lines.append((x+c-0.2, y+0.5, x+c+0.2, y+0.5))
+                    else:
+                        lines.append((x+0.5, y+c-0.2, x+0.5, y+c+0.2))
+                else:
+                    if clue.direction == "across":
+                        lines.append((x+c, y, x+c, y+1))
+                    else:
+                        lines.append((x, y+c, x+1, y+c))
+    return lines
+
+
+def fetch_puzzle(number, archive=None):
+    # Take the crossword from the archive if it is there. Otherwise get the print version, and the
+    # web version too if the date index cannot say when it was published
+    if archive is not None and number in archive:
+        with profiling.stage("load", number=number):
+            puzzle = Puzzle.from_record(archive[number])
+        puzzle.fetch_latency = 0
+    else:
+        date = get_date_index().lookup(number)
+        with profiling.stage("fetch", number=number):
+            print_html, web_html, fetch_latency = get_fetcher().fetch_crossword(number, web=date is None)
+        with profiling.stage("parse", number=number):
+            puzzle = Puzzle.from_guardian_html(number, print_html, web_html, date)
+        if date is None:
+            get_date_index().add(number, puzzle.date)
+        puzzle.fetch_latency = fetch_latency
+    with profiling.stage("headlines", number=number):
+        puzzle.headlines = get_headline_provider().headlines(puzzle.date)
+        puzzle.headline_weights = headline_weights(puzzle.headlines)
+    return puzzle
+
+
+# (PIL mode, FPDF image filter, zlib level) for each kind of image on a page.
+# "AUTO" stores 1-bit images with CCITT fax compression, which suits the QR code.
+IMAGE_FORMATS = {
+    "grid": ("L", "FlateDecode", 6),
+    "wordart": ("RGBA", "FlateDecode", 1),
+    "qrcode": ("1", "AUTO", -1),
+}
+
+
+def parse_image_format(text):
+    # KIND=FILTER[:LEVEL][:MODE], eg. wordart=FlateDecode:9 or grid=DCTDecode
+    kind, _, spec = text.partition("=")
+    if kind not in IMAGE_FORMATS:
+        raise argparse.ArgumentTypeError(f"unknown image kind {kind!r}, expected one of {', '.join(IMAGE_FORMATS)}")
+    mode, image_filter, level = IMAGE_FORMATS[kind]
+    parts = spec.split(":")
+    image_filter = parts[0] or image_filter
+    if image_filter not in fpdf.image_parsing.SUPPORTED_IMAGE_FILTERS:
+        raise argparse.ArgumentTypeError(f"unknown image filter {image_filter!r}, expected one of "
+                                         f"{', '.join(fpdf.image_parsing.SUPPORTED_IMAGE_FILTERS)}")
+    if len(parts) > 1 and parts[1]:
+        try:
+            level = int(parts[1])
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"compression level {parts[1]!r} must be a whole number")
+        if not -1 <= level <= 9:
+            raise argparse.ArgumentTypeError(f"compression level {level} must be from -1 (zlib's default) to 9")
+    rendered_mode = mode
+    if len(parts) > 2 and parts[2]:
+        mode = parts[2]
+        try:
+            ImageMode.getmode(mode)
+        except KeyError:
+            raise argparse.ArgumentTypeError(f"unknown image mode {mode!r}, expected a PIL mode such as L, RGB or RGBA")
+
+    # Not every mode converts from the one the kind is rendered in, or can be stored with every
+    # filter, so try it on a tiny image now rather than fail on every page
+    try:
+        pdf = fpdf.FPDF()
+        pdf.add_page()
+        pdf.set_image_filter(image_filter)
+        pdf.image(Image.new(rendered_mode, (8, 8)).convert(mode), x=0, y=0, w=1)
+        pdf.output()
+    except (ValueError, OSError) as e:
+        raise argparse.ArgumentTypeError(f"cannot store {kind} images in mode {mode} with {image_filter}: {e}")
+    return kind, (mode, image_filter, level)
+
+
+def encode_image(image):
+    # PNG at the WordArt cache's fast setting: a page's images stay small in the pool's result
+    # pipe and in the work dir, and only layout_page decodes them
+    if image is None:
+        return None
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def decode_image(png):
+    # Images that were never encoded are passed through
+    return Image.open(io.BytesIO(png)) if isinstance(png, bytes) else png
+
+
+class PageContent:
+    # The rendered pieces of a page as PNG bytes, small enough to send back from a worker and lay out elsewhere
+    def __init__(self, puzzle, grid, wordart, qrcode):
+        self.puzzle = puzzle
+        self.grid = grid
+        self.wordart = wordart
+        self.qrcode = qrcode
 
 
 class GuardianQuickCrossword(fpdf.FPDF):
-    def __init__(self, right_handed=True):
+    def __init__(self, right_handed=True, vector_grid=True, dpi=150, seed=None, image_formats=None):
         super().__init__(orientation="landscape")
         self.set_auto_page_break(False, 0)
         self.right_handed = right_handed
+        self.vector_grid = vector_grid
+        self.dpi = dpi
+        self.seed = seed
+        self.image_formats = IMAGE_FORMATS | (image_formats or dict())
         self.page_margin = 5
         self.clue_margin = 3
         self.news_height = 7
@@ -98,93 +419,115 @@ class GuardianQuickCrossword(fpdf.FPDF):
         self.add_font(family="Guardian", style="b", fname=Path("fonts/GHGuardianHeadline-Bold.ttf"))
         self.set_font(family="Guardian", style="", size=14)
 
-    def generate_new_page(self, number):
-        self.add_page()
+    def render_page(self, puzzle):
+        # Laid out in the same process, so the images are handed over without encoding them
+        self.layout_page(self.render_content(puzzle, encode=False))
 
-        # Get the crossword and parse using bs4
-        url = f"https://www.theguardian.com/crosswords/quick/{number}/print"
-        resp = requests.get(url)
-        soup = BeautifulSoup(resp.text, features="html.parser")
-        number = number
-
-        # Get the web version and scrape for the date
-        s = BeautifulSoup(requests.get(f"https://www.theguardian.com/crosswords/quick/{number}").text,  features="html.parser")
-        elem = s.find("div", attrs={"data-gu-name": "dateline"})
-        date = dt.datetime.strptime(" ".join(elem.text.split()[:-1]), r"%a %d %b %Y %H.%M")
-
-        # Extract clues
-        a, d = soup.find_all(class_="printable-crossword__clues")
-        across_clues = [Clue.from_guardian_soup(tag, "across") for tag in a.find_all("li")]
-        down_clues = [Clue.from_guardian_soup(tag, "down") for tag in d.find_all("li")]
-        all_clues = across_clues + down_clues
+    def render_content(self, puzzle, encode=True):
+        # All of the CPU-heavy image work for a page, without touching the PDF
+        if self.vector_grid:
+            # Drawn straight onto the page in layout_page
+            grid = None
+        else:
+            grid = self.render_crossword_image(puzzle.white_cells, puzzle.across + puzzle.down, puzzle.nx, puzzle.ny,
+                                               breaks=puzzle.breaks)
+        art = self.render_wordart_image(puzzle.number)
+        qr = self.render_qrcode(web_url(puzzle.number))
+        if encode:
+            grid, art, qr = encode_image(grid), encode_image(art), encode_image(qr)
+        return PageContent(puzzle, grid, art, qr)
 
-        # Extract white cells 
-        white_cells = [WhiteCell.from_guardian_soup(x) for x in soup.find(class_="cells").find_all(recursive=False)]
+    def layout_page(self, content):
+        puzzle = content.puzzle
+        self.add_page()
 
-        # Create the crossword grid
-        self.create_crossword_image(white_cells, all_clues)
+        # Place the crossword grid
+        if content.grid is None:
+            self.draw_crossword_grid(puzzle.white_cells, puzzle.across + puzzle.down, puzzle.nx, puzzle.ny,
+                                     breaks=puzzle.breaks)
+        else:
+            self.place_crossword_image(decode_image(content.grid))
 
         # Draw the clues
-        self.draw_clues(across_clues, down_clues)
+        self.draw_clues(puzzle.across, puzzle.down)
 
-        # Create the wordart
-        self.create_wordart_image(number)
+        # Place the wordart
+        self.place_wordart_image(decode_image(content.wordart))
 
         # Draw the news headlines
-        self.draw_news(date)
+        self.draw_news(puzzle.date, puzzle.headlines, puzzle.headline_weights)
 
-        # Draw the QR code
-        self.create_qrcode(f"https://www.theguardian.com/crosswords/quick/{number}")
+        # Place the QR code
+        self.place_qrcode(decode_image(content.qrcode))
 
-    def create_crossword_image(self, white_cells, clues, nx=13, ny=13, lw=1):
+    @profiling.timed("grid")
+    def render_crossword_image(self, white_cells, clues, nx=13, ny=13, lw=1, breaks=None):
+        if breaks is None:
+            breaks = grid_breaks(white_cells, clues)
         image = Image.new(mode="L", size=(nx*self.res, ny*self.res), color=0)
         draw = ImageDraw.Draw(image)
 
-        clue_map = dict()
-
         for cell in white_cells:
             draw.rectangle((cell.x*self.res, cell.y*self.res, (cell.x+1)*self.res, (cell.y+1)*self.res), fill=255, outline=0, width=lw)
             draw.text(((cell.x+0.05)*self.res, (cell.y+0.05)*self.res), text=cell.clue_number, font=self.imfont, anchor="lt", fill=0)
-            if cell.is_clue_start():
-                clue_map[cell.clue_number] = (cell.x, cell.y)
         draw.rectangle((0,0,image.width,image.height), fill=None, outline=0, width=2)
 
-        for clue in clues:
-            if a := clue.get_multiword_lengths():
-                try:
-                    x,y = clue_map[clue.number]
-                except:
-                    # sometimes the guardian puts multiple clue numbers on one line. cant be bothered to parse that
-                    continue
-                
-                lengths, delims = a
-                cum_length = np.cumsum(lengths)
-                for d, c in zip(delims, cum_length):
-                    if d == "-":
-                        if clue.direction == "across":
-                            draw.line(((x+c-0.2)*self.res, (y+0.5)*self.res, (x+c+0.2)*self.res, (y+0.5)*self.res), fill=0, width=lw*5)
-                        else:
-                            draw.line(((x+0.5)*self.res, (y+c-0.2)*self.res, (x+0.5)*self.res, (y+c+0.2)*self.res), fill=0, width=lw*5)
-                    else:
-                        if clue.direction == "across":
-                            draw.line(((x+c)*self.res, y*self.res, (x+c)*self.res, (y+1)*self.res), fill=0, width=lw*5)
-                        else:
-                            draw.line((x*self.res, (y+c)*self.res, (x+1)*self.res, (y+c)*self.res), fill=0, width=lw*5)
+        for x0, y0, x1, y1 in breaks:
+            draw.line((x0*self.res, y0*self.res, x1*self.res, y1*self.res), fill=0, width=lw*5)
         
-        buf = io.BytesIO()
-        image.save(buf, format="PNG")
-        buf.seek(0)
+        return image
+
+    def place_crossword_image(self, image):
         if self.right_handed:
             x = self.page_margin + 2*self.clue_margin + 2*self.clue_width
-            self.image(buf, x=x, y=self.page_margin, w=self.w/2-self.page_margin)
+            self.place_image("grid", image, x=x, y=self.page_margin, w=self.w/2-self.page_margin)
+        else:
+            self.place_image("grid", image, x=self.page_margin, y=self.page_margin, w=self.w/2-self.page_margin)
+
+    @profiling.timed("grid")
+    def draw_crossword_grid(self, white_cells, clues, nx=13, ny=13, lw=1, breaks=None):
+        # Vector version of render_crossword_image, with line widths scaled to match it
+        if breaks is None:
+            breaks = grid_breaks(white_cells, clues)
+        if self.right_handed:
+            left = self.page_margin + 2*self.clue_margin + 2*self.clue_width
         else:
-            self.image(buf, x=self.page_margin, y=self.page_margin, w=self.w/2-self.page_margin)
+            left = self.page_margin
+        top = self.page_margin
+        size = (self.w/2 - self.page_margin) / nx
+        font_size = size * 72/25.4 / 3.5
+
+        self.set_fill_color(0)
+        self.set_draw_color(0)
+        self.rect(left, top, nx*size, ny*size, style="F")
+
+        self.set_fill_color(255)
+        self.set_line_width(lw*size/100)
+        self.set_font("Guardian", "", font_size)
+        for cell in white_cells:
+            x = left + cell.x*size
+            y = top + cell.y*size
+            self.rect(x, y, size, size, style="DF")
+            if cell.is_clue_start():
+                self.text(x + 0.05*size, y + 0.05*size + font_size*25.4/72*0.75, cell.clue_number)
+        self.set_font("Guardian", "", 14)
+
+        self.set_line_width(2*lw*size/100)
+        self.rect(left, top, nx*size, ny*size, style="D")
 
-    def create_wordart_image(self, number):
-        w = wordart.WordArt.randomise(number)
-        w._expand_canvas(1.1)
-        img = w.to_buffer()
+        self.set_line_width(5*lw*size/100)
+        for x0, y0, x1, y1 in breaks:
+            self.line(left + x0*size, top + y0*size, left + x1*size, top + y1*size)
+        self.set_line_width(0.2)
 
+    @profiling.timed("wordart")
+    def render_wordart_image(self, number):
+        # Render at the size the slot will be printed at, rather than shrinking a bigger image
+        _, _, w, h = self.wordart_slot()
+        fit = (w / 25.4 * self.dpi, h / 25.4 * self.dpi)
+        return wordart.render_image(number, seed=self.seed, expand=1.1, fit=fit)
+
+    def wordart_slot(self):
         crossword_height = self.w/2 - self.page_margin
         top = crossword_height + 2*self.page_margin
         bottom = self.h - self.page_margin - self.news_height
@@ -192,13 +535,18 @@ class GuardianQuickCrossword(fpdf.FPDF):
             x = self.page_margin + 2*self.clue_width + 2*self.clue_margin
         else:
             x = self.page_margin
-        self.image(img, 
-                   x, top, 
-                   w=self.w/2-self.page_margin,
-                   h=bottom-top,
-                   keep_aspect_ratio=True)
+        return x, top, self.w/2-self.page_margin, bottom-top
+
+    def place_wordart_image(self, img):
+        x, top, w, h = self.wordart_slot()
+        self.place_image("wordart", img,
+                         x, top, 
+                         w=w,
+                         h=h,
+                         keep_aspect_ratio=True)
 
-    def create_qrcode(self, url):
+    @profiling.timed("qrcode")
+    def render_qrcode(self, url):
         qr = qrcode.QRCode(
             version=1,
             error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -208,25 +556,33 @@ class GuardianQuickCrossword(fpdf.FPDF):
         qr.add_data(url)
         qr.make(fit=True)
 
-        img = qr.make_image(fill_color="black", back_color="white")
-        imgbuffer = io.BytesIO()
-        img.save(imgbuffer, format="PNG")
-        
+        return qr.make_image(fill_color="black", back_color="white").get_image()
+
+    def place_qrcode(self, image):
         x = self.page_margin if self.right_handed else self.w - self.page_margin - 25
-        self.image(imgbuffer, x=x, y=self.h - self.page_margin - 30)
+        self.place_image("qrcode", image, x=x, y=self.h - self.page_margin - 30)
+
+    def place_image(self, kind, image, *args, **kwargs):
+        # Hand the PIL image straight to FPDF, in the mode and with the compression set for its kind
+        mode, image_filter, level = self.image_formats[kind]
+        with profiling.stage(f"place {kind}"):
+            if isinstance(image, Image.Image) and image.mode != mode:
+                image = image.convert(mode)
+            self.set_image_filter(image_filter)
+            # The level is a process-wide FPDF setting, so put it back for whatever uses FPDF next
+            previous = fpdf.image_parsing.SETTINGS.compression_level
+            fpdf.image_parsing.SETTINGS.compression_level = level
+            try:
+                self.image(image, *args, **kwargs)
+            finally:
+                fpdf.image_parsing.SETTINGS.compression_level = previous
 
-    def draw_news(self, date):
+    @profiling.timed("news")
+    def draw_news(self, date, headlines=None, weights=None):
         date = date.date()
-        gnf = GoogleNewsFeed(language='en',country='GB')
-        headlines = gnf.query("news", before=date+dt.timedelta(days=1), after=date)
-        sia = _get_sia()
-        heads = []
-        sentiments = []
-        for h in headlines:
-            score = sia.polarity_scores(str(h))
-            heads.append(str(h))
-            sentiments.append(score['compound'] + 1)
-        headline = random.choices(heads, weights=sentiments, k=1)[0]
+        if headlines is None:
+            headlines = get_headline_provider().headlines(date)
+        headline = pick_headline(headlines, weights)
 
         top = self.h - self.page_margin - self.news_height
         if self.right_handed:
@@ -241,6 +597,7 @@ class GuardianQuickCrossword(fpdf.FPDF):
                         markdown=True)
         self.set_font("Guardian", "", 14)
 
+    @profiling.timed("clues")
     def draw_clues(self, across, down):
         h = 11
         if self.right_handed:
@@ -281,18 +638,47 @@ class GuardianQuickCrossword(fpdf.FPDF):
         # self.line(0,self.h-self.page_margin,self.w,self.h-self.page_margin, )
         # self.line(self.w/2,0,self.w/2,self.h)
 
+    @profiling.timed("output")
     def output_to_buffer(self):
         return io.BytesIO(self.output())
 
 
-def _get_sia():
-    try:
-        return SentimentIntensityAnalyzer()
-    except LookupError:
-        import nltk
-        nltk.download("vader_lexicon")
-        return SentimentIntensityAnalyzer()
-    
+def add_page_arguments(parser):
+    # Options for fetching and rendering pages, shared with service.py
+    parser.add_argument("--offline", action="store_true", default=False, help="Only use cached Guardian pages, never touch the network")
+    parser.add_argument("--cache-dir", default=Path(os.getcwd()) / "cache", help="Directory for cached Guardian pages (default is cwd/cache/)")
+    parser.add_argument("--cache-size", type=int, default=500, help="Maximum size of the page cache in MB (default 500)")
+    parser.add_argument("--fetch-threads", type=int, default=16, help="Number of threads fetching crosswords while the others are rendered (default 16)")
+    parser.add_argument("--max-connections", type=int, default=16, help="Most requests to one site at once. The limit adapts to how the site responds, up to this (default 16)")
+    parser.add_argument("--retries", type=int, default=5, help="Times to retry a request that timed out or got a 429 or 5xx response (default 5)")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a response before retrying (default 30)")
+    parser.add_argument("--news-fixture", default=None, help="JSON file of headlines per date to use instead of Google News")
+    parser.add_argument("--single-document", action="store_true", default=False, help="Lay out all pages in one document so fonts are embedded once (smaller, faster to merge)")
+    parser.add_argument("--raster-grid", action="store_true", default=False, help="Embed the crossword grid as an image instead of drawing it as vector graphics")
+    parser.add_argument("--dpi", type=int, default=150, help="Resolution the WordArt is rendered at (default 150)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the WordArt, so rebuilds give the same art and can reuse cached renders")
+    parser.add_argument("--wordart-cache-size", type=int, default=200, help="Maximum size of the WordArt cache in MB (default 200)")
+    parser.add_argument("--image-format", type=parse_image_format, action="append", default=[], help="How to store an image kind (grid, wordart or qrcode) as KIND=FILTER[:LEVEL][:MODE], eg. wordart=FlateDecode:9")
+
+
+def page_settings(args):
+    return {
+        "offline": args.offline,
+        "cache_dir": Path(args.cache_dir),
+        "cache_size": args.cache_size,
+        "fetch_threads": args.fetch_threads,
+        "max_connections": args.max_connections,
+        "retries": args.retries,
+        "timeout": args.timeout,
+        "news_fixture": args.news_fixture,
+        "single_document": args.single_document,
+        "raster_grid": args.raster_grid,
+        "dpi": args.dpi,
+        "seed": args.seed,
+        "wordart_cache_size": args.wordart_cache_size,
+        "image_formats": dict(args.image_format),
+    }
+
 
 def parse_args():
     # Interactive mode
@@ -305,17 +691,38 @@ def parse_args():
                 "number": num, 
                 "out": Path(os.getcwd()) / "pdfs", 
                 "left_handed": False,
-                "track": True}
+                "track": True,
+                "offline": False,
+                "cache_dir": Path(os.getcwd()) / "cache",
+                "cache_size": 500,
+                "fetch_threads": 16,
+                "max_connections": 16,
+                "retries": 5,
+                "timeout": 30,
+                "news_fixture": None,
+                "single_document": False,
+                "raster_grid": False,
+                "dpi": 150,
+                "seed": None,
+                "wordart_cache_size": 200,
+                "image_formats": dict(),
+                "profile": None,
+                "work_dir": None,
+                "archive": None}
     
     # Read command line arguments
     else:  
         parser = argparse.ArgumentParser(description="Utility for generating PDFs of the Guardian Quick crossword.")
-        parser.add_argument("--from",   type=int,  help="The crossword number to start at (inclusive). Specify exactly two of --from, --to, --number")
+        parser.add_argument("--from",   type=int, dest="from_",  help="The crossword number to start at (inclusive). Specify exactly two of --from, --to, --number")
         parser.add_argument("--to",     type=int,  help="The crossword number to end at (exclusive). Specify exactly two of --from, --to, --number")
         parser.add_argument("--number", type=int,  help="Number of crosswords to generate. Specify exactly two of --from, --to, --number")
         parser.add_argument("--out", default=Path(os.getcwd()) / "pdfs", help="Output directory for the generated PDF (default is cwd/pdfs/)")
         parser.add_argument("--left-handed", action="store_true", default=False, help="Generate left-handed crosswords (grid on left)")
         parser.add_argument("--track", action="store_true", default=False, help="Modify the tracker file after generation")
+        add_page_arguments(parser)
+        parser.add_argument("--work-dir", default=None, help="Directory where finished pages are kept until the PDF is written, so a failed run can be resumed (default is cache/work/FROM_TO)")
+        parser.add_argument("--archive", default=None, help="Puzzle archive file: crosswords in it are rendered without fetching, and newly fetched ones are added to it")
+        parser.add_argument("--profile", default=None, help="Time every stage of every page and write a Chrome/Perfetto trace to this JSON file")
         args = parser.parse_args()
 
         provided = [args.from_ is not None,
@@ -344,47 +751,360 @@ def parse_args():
             "number": args.number,
             "out": Path(args.out),
             "left_handed": args.left_handed,
-            "track": args.track
+            "track": args.track,
+            **page_settings(args),
+            "profile": args.profile,
+            "work_dir": Path(args.work_dir) if args.work_dir else None,
+            "archive": Path(args.archive) if args.archive else None
         }
 
 
-def build_single_page(number, right_handed):
-    page = GuardianQuickCrossword(right_handed=right_handed)
-    page.generate_new_page(number)
-    return number, page.output_to_buffer()  # return number so we can re-order later
+def get_page_options(args, right_handed=True):
+    return {"right_handed": right_handed, "vector_grid": not args["raster_grid"],
+            "dpi": args["dpi"], "seed": args["seed"], "image_formats": args["image_formats"]}
+
+
+def worker_initargs(args, page_options=None, trace_dir=None):
+    # Arguments for init_worker, in the main process and every pool worker
+    return ((args["cache_dir"], args["cache_size"] * 1024**2, args["offline"]),
+            (args["cache_dir"], args["offline"], args["news_fixture"]),
+            (args["cache_dir"] / "wordart", args["wordart_cache_size"] * 1024**2),
+            page_options, trace_dir,
+            (args["max_connections"], args["retries"], args["timeout"]))
+
+
+def init_worker(fetcher_settings, headline_settings, wordart_settings, page_options=None, trace_dir=None, scheduler_settings=()):
+    configure_scheduler(*scheduler_settings)
+    configure_fetcher(*fetcher_settings)
+    # The date index lives with the page cache
+    configure_date_index(fetcher_settings[0])
+    wordart.configure_font_catalogue(fetcher_settings[0])
+    configure_headlines(*headline_settings)
+    wordart.configure_wordart_cache(*wordart_settings)
+    profiling.configure_profiler(trace_dir)
+    if page_options is not None:
+        with profiling.stage("warm up"):
+            warm_up(page_options)
+        profiling.flush()
+
+
+_warmed_up = None
+
+
+def warm_up(page_options):
+    # Load what the first page would otherwise wait for: the font catalogue, the colormaps,
+    # a renderer with its fonts parsed and qrcode's image backend, which it imports lazily.
+    # Workers forked after this has run in the main process inherit all of it, as init_worker
+    # keeps anything already set up for the same settings, so they skip it
+    global _warmed_up
+    if _warmed_up == page_options:
+        return
+    wordart.get_font_catalogue()
+    wordart.colormap_names()
+    get_renderer(**page_options).render_qrcode(web_url(0))
+    _warmed_up = page_options
+
+
+def render_single_page(puzzle, **options):
+    with profiling.stage("page", number=puzzle.number):
+        page = GuardianQuickCrossword(**options)
+        page.render_page(puzzle)
+        buffer = page.output_to_buffer()
+    profiling.flush()
+    return puzzle.number, buffer, puzzle.fetch_latency
+
+
+_renderer = None
+
+
+def get_renderer(**options):
+    # Images only need the renderer's settings and fonts, so each worker builds one and reuses it
+    global _renderer
+    if _renderer is None or _renderer.options != options:
+        _renderer = GuardianQuickCrossword(**options)
+        _renderer.options = options
+    return _renderer
+
+
+def render_page_content(puzzle, **options):
+    with profiling.stage("page", number=puzzle.number):
+        content = get_renderer(**options).render_content(puzzle)
+    profiling.flush()
+    return puzzle.number, content, puzzle.fetch_latency
+
+
+class PageFailed:
+    def __init__(self, number, error):
+        self.number = number
+        self.error = error
+
+
+def generate_pages(numbers, pool, render, fetch_threads=8, max_pending=16, ordered=False, keep_going=False,
+                   fetch=fetch_puzzle):
+    """
+    Two-stage pipeline: a set of threads fetches and parses puzzles with fetch(number) while the process
+    pool renders them with the given function.
+    At most max_pending puzzles are fetched but not yet handed back to the caller, so the fetch
+    threads block (rather than buffering the whole range) when rendering falls behind.
+
+    Yields (number, page, fetch_latency) in completion order, or in the order of numbers if ordered
+    is set. Pages that finish early then wait in a reorder buffer, which also counts towards max_pending.
+    The first page to fail stops the pipeline with its error, unless keep_going is set, in which case
+    a PageFailed is yielded in its place.
+    """
+    numbers = list(numbers)
+    events = queue.Queue()
+    slots = threading.Semaphore(max_pending)
+    remaining = iter(numbers)
+    lock = threading.Lock()
+
+    def fetch_worker():
+        while True:
+            slots.acquire()
+            with lock:
+                number = next(remaining, None)
+            if number is None:
+                slots.release()
+                return
+            try:
+                events.put(fetch(number))
+            except Exception as e:
+                events.put(PageFailed(number, e))
+
+    for i in range(min(fetch_threads, len(numbers))):
+        threading.Thread(target=fetch_worker, name=f"fetch {i}", daemon=True).start()
+
+    completed = 0
+    reorder = dict()
+    while completed < len(numbers):
+        item = events.get()
+        if isinstance(item, PageFailed) and not keep_going:
+            raise item.error
+        if isinstance(item, Puzzle):
+            pool.apply_async(render, (item,), callback=events.put,
+                             error_callback=lambda e, number=item.number: events.put(PageFailed(number, e)))
+        elif not ordered:
+            completed += 1
+            slots.release()
+            yield item
+        else:
+            reorder[item.number if isinstance(item, PageFailed) else item[0]] = item
+            while completed < len(numbers) and numbers[completed] in reorder:
+                completed += 1
+                slots.release()
+                yield reorder.pop(numbers[completed-1])
+
+
+class PdfPageStream:
+    """
+    Writes the pages of other PDFs to a file as they are added, so only one page is in memory at a
+    time, where pypdf's PdfWriter would keep every page until the end. Each page's objects are
+    copied out under new object numbers, and the page tree and cross-reference table follow the
+    last page.
+    """
+    def __init__(self, file):
+        self.file = file
+        self.position = 0
+        self.offsets = []
+        self.kids = []
+        self._write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self.catalog = self._reserve()
+        self.pages = self._reserve()
+
+    def _reserve(self):
+        self.offsets.append(None)
+        return len(self.offsets)
+
+    def _write(self, data):
+        # Counted rather than asked of the file, which may be a socket or pipe
+        self.file.write(data)
+        self.position += len(data)
+
+    def _write_object(self, number, obj):
+        buffer = io.BytesIO()
+        obj.write_to_stream(buffer)
+        self.offsets[number - 1] = self.position
+        self._write(f"{number} 0 obj\n".encode() + buffer.getvalue() + b"\nendobj\n")
+
+    def add(self, pdf):
+        import pypdf
+        from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject
+
+        for page in pypdf.PdfReader(pdf).pages:
+            numbers = dict()
+            pending = []
+
+            def renumber(obj):
+                # Swap the reader's references for ours, queueing each object it refers to once
+                if isinstance(obj, IndirectObject):
+                    key = (obj.idnum, obj.generation)
+                    if key not in numbers:
+                        numbers[key] = self._reserve()
+                        pending.append(obj)
+                    return IndirectObject(numbers[key], 0, None)
+                if isinstance(obj, DictionaryObject):
+                    for key, value in obj.items():
+                        obj[key] = renumber(value)
+                elif isinstance(obj, ArrayObject):
+                    for i, value in enumerate(obj):
+                        obj[i] = renumber(value)
+                return obj
+
+            number = self._reserve()
+            del page[NameObject("/Parent")]
+            renumber(page)
+            page[NameObject("/Parent")] = IndirectObject(self.pages, 0, None)
+            self._write_object(number, page)
+            self.kids.append(number)
+            while pending:
+                ref = pending.pop()
+                self._write_object(numbers[(ref.idnum, ref.generation)], renumber(ref.get_object()))
+
+    def close(self):
+        kids = " ".join(f"{n} 0 R" for n in self.kids)
+        for number, body in ((self.pages, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.kids)} >>"),
+                             (self.catalog, f"<< /Type /Catalog /Pages {self.pages} 0 R >>")):
+            self.offsets[number - 1] = self.position
+            self._write(f"{number} 0 obj\n{body}\nendobj\n".encode())
+
+        xref = self.position
+        entries = "".join(f"{offset:010d} 00000 n \n" for offset in self.offsets)
+        self._write((f"xref\n0 {len(self.offsets) + 1}\n0000000000 65535 f \n{entries}"
+                     f"trailer\n<< /Size {len(self.offsets) + 1} /Root {self.catalog} 0 R >>\n"
+                     f"startxref\n{xref}\n%%EOF\n").encode())
+
+
+class PageWriter:
+    """
+    Writes finished pages to the output file in the order they are added, either by streaming
+    per-page PDFs straight into it or by laying out PageContents in one document. The document
+    keeps every page until it is closed, which is the price of embedding the fonts only once.
+    """
+    def __init__(self, filename, single_document=False, **options):
+        self.filename = filename
+        self.single_document = single_document
+        if single_document:
+            self.document = GuardianQuickCrossword(**options)
+            return
+        # A path, written under a temporary name until it is complete, or a file object such as a BytesIO
+        if hasattr(filename, "write"):
+            self.file = filename
+        else:
+            self.tmp = Path(filename).with_name(f"{Path(filename).name}.tmp")
+            self.file = open(self.tmp, "wb")
+        self.stream = PdfPageStream(self.file)
+
+    def add(self, page):
+        if self.single_document:
+            self.document.layout_page(page)
+        else:
+            self.stream.add(page)
+
+    def close(self):
+        if self.single_document:
+            self.document.output(self.filename)
+            return
+        self.stream.close()
+        if self.file is not self.filename:
+            self.file.close()
+            os.replace(self.tmp, self.filename)
 
 
 if __name__ == "__main__":
     # Read in arguments from command line or interactively
     args = parse_args()
-    right_handed = not args["left_handed"]
+    page_options = get_page_options(args, right_handed=not args["left_handed"])
 
     # Set up multiprocessing pool
-    manager = Manager()
-    page_buffers = manager.dict() 
     n_processes = min(cpu_count(), args["number"])
+    trace_dir = profiling.make_trace_dir() if args["profile"] else None
+    initargs = worker_initargs(args, page_options, trace_dir)
+    init_worker(*initargs)
+    if not args["offline"]:
+        ensure_vader_lexicon()
+    get_sia()
+
+    # Crosswords already in the archive need no fetching at all
+    numbers = range(args["from"], args["to"])
+    archive = PuzzleArchive(args["archive"]) if args["archive"] else None
+    fetched = []
+    if archive is not None:
+        print(f"{sum(n in archive for n in numbers)}/{len(numbers)} crosswords are in {args['archive']}")
 
-    # Build pages in parallel
+    def fetch(number):
+        puzzle = fetch_puzzle(number, archive)
+        if archive is not None and number not in archive:
+            fetched.append(puzzle)
+        return puzzle
+
+    # Work out the dates of the rest of the range at once, so that most pages can skip fetching the web page
+    to_fetch = [n for n in numbers if archive is None or n not in archive]
+    with profiling.stage("dates"):
+        dates = get_date_index().resolve(to_fetch, fetch_date)
+    if to_fetch:
+        print(f"Publication dates known for {sum(d is not None for d in dates.values())}/{len(to_fetch)} crosswords")
+
+    # Pages finished by an earlier run of the same range are kept in the working directory
+    work_dir = args["work_dir"] or args["cache_dir"] / "work" / f"{args['from']}_{args['to']}"
+    checkpoint = Checkpoint(work_dir, page_options | {"single_document": args["single_document"]})
+    todo = [number for number in numbers if not checkpoint.done(number)]
+    if len(todo) < len(numbers):
+        print(f"Resuming: {len(numbers) - len(todo)}/{len(numbers)} pages were already done")
+
+    # Build pages in parallel, saving each one as soon as it is done
     print("Starting generation...")
-    with Pool(processes=n_processes) as pool:
-        imap = pool.imap_unordered(partial(build_single_page, right_handed=right_handed), list(range(args["from"], args["to"])))
-        completed = 0
-        for number, buffer_obj in imap:
-            page_buffers[number] = buffer_obj
+    n_processes = max(1, min(n_processes, len(todo)))
+    with Pool(processes=n_processes, initializer=init_worker, initargs=initargs) as pool:
+        if args["single_document"]:
+            render = partial(render_page_content, **page_options)
+        else:
+            render = partial(render_single_page, **page_options)
+        # Enough pages in flight for the fetches to reach the connection limit, not just keep the workers busy
+        pages = generate_pages(todo, pool, render, fetch_threads=args["fetch_threads"],
+                               max_pending=max(2*n_processes, args["fetch_threads"]), keep_going=True, fetch=fetch)
+
+        completed = len(numbers) - len(todo)
+        for item in pages:
+            if isinstance(item, PageFailed):
+                checkpoint.fail(item.number, item.error)
+                print(f"#{item.number} failed: {checkpoint.failed[str(item.number)]}")
+                continue
+            number, page, fetch_latency = item
+            with profiling.stage("save page", number=number):
+                checkpoint.save(number, page)
             completed += 1
-            print(f"{completed}2/{args['number']} pages completed")
-
-    # Merge pages in order
-    merger = pypdf.PdfWriter()
-    for number in range(args["from"], args["to"]):
-        merger.append(page_buffers[number])
-
-    # Write final PDF to disk
-    output_filename = args["out"] / f"{args['from']}_{args['to']}.pdf"
-    with open(output_filename, "wb") as f:
-        merger.write(f)
-        merger.close()
-    print(f"The PDF is at {output_filename}")
+            print(f"{completed}/{len(numbers)} pages completed (#{number} fetched in {fetch_latency:.2f}s)")
+
+    if archive is not None:
+        # A mapped file cannot be replaced on Windows, so copy the records out and close it first
+        records = [*archive] if fetched else []
+        archive.close()
+        if fetched:
+            write_archive(args["archive"], [*records, *(puzzle.to_record() for puzzle in fetched)])
+            print(f"Added {len(fetched)} crosswords to {args['archive']}")
+
+    if checkpoint.failed:
+        print(f"{len(checkpoint.failed)} pages failed, so no PDF was written. The other pages are saved in {work_dir}: "
+              "run the same command again to retry just the failed ones.")
+    else:
+        # Every page is on disk, so write them out in order, only holding one at a time
+        output_filename = args["out"] / f"{args['from']}_{args['to']}.pdf"
+        writer = PageWriter(output_filename, args["single_document"], **page_options)
+        for number in numbers:
+            with profiling.stage("write page", number=number):
+                writer.add(checkpoint.load(number))
+        with profiling.stage("write file"):
+            writer.close()
+        checkpoint.remove()
+        print(f"The PDF is at {output_filename}")
+
+    if args["profile"]:
+        events = profiling.write_trace(args["profile"])
+        print(profiling.summary(events))
+        print(f"The trace is at {args['profile']} (open it in https://ui.perfetto.dev or chrome://tracing)")
+
+    if checkpoint.failed:
+        sys.exit(1)
 
     # Update tracker
     if args["track"]:
@@ -0,0 +1,154 @@
+import json
+import random
+import threading
+import functools
+from pathlib import Path
+import datetime as dt
+
+import numpy as np
+
+from cache import DiskCache
+from fetch import TimedSession
+from scheduler import get_scheduler, get_timeout
+
+
+class HeadlineProvider:
+    """
+    Supplies the news headlines for a date. Results are kept per date so that pages sharing a
+    date only trigger one lookup, even when several fetch threads ask for it at once. A lookup
+    that fails returns None and is not kept, so the next page with that date tries again.
+    """
+    def __init__(self):
+        self._headlines = dict()
+        self._locks = dict()
+        self._lock = threading.Lock()
+
+    def headlines(self, date):
+        if isinstance(date, dt.datetime):
+            date = date.date()
+        with self._lock:
+            lock = self._locks.setdefault(date, threading.Lock())
+        with lock:
+            if date not in self._headlines:
+                headlines = self._lookup(date)
+                if headlines is None:
+                    return []
+                self._headlines[date] = headlines
+            return self._headlines[date]
+
+    def _lookup(self, date):
+        raise NotImplementedError
+
+
+class GoogleNewsHeadlines(HeadlineProvider):
+    def __init__(self, cache_dir=None, cache_size=50*1024**2, offline=False):
+        super().__init__()
+        self.cache = DiskCache(cache_dir, cache_size) if cache_dir is not None else None
+        self.offline = offline
+
+    def _lookup(self, date):
+        name = f"{date.isoformat()}.json"
+        if self.cache is not None:
+            cached = self.cache.read(name)
+            if cached is not None:
+                return json.loads(cached)
+        if self.offline:
+            return []
+
+        # Only needed on a cache miss, and slow to import, so render workers never load it
+        from google_news_feed import GoogleNewsFeed, HEADERS, COOKIES
+        session = TimedSession(get_timeout())
+        session.headers.update(HEADERS)
+        session.cookies.update(COOKIES)
+        # Only the titles are used, so the links are left as they are rather than each fetched to resolve them
+        gnf = GoogleNewsFeed(language='en', country='GB', client=session, resolve_internal_links=False)
+        query = lambda: [str(h) for h in gnf.query("news", before=date+dt.timedelta(days=1), after=date)]
+        try:
+            # Timeouts, dropped connections, 429s and 5xxs are retried; a feed that will not parse is not
+            headlines = get_scheduler().run("news.google.com", query)
+        except Exception as e:
+            # A page without a headline is better than no page, and the next page with this date will try again
+            print(f"Could not get the headlines for {date}: {e}")
+            return None
+        finally:
+            session.close()
+        if self.cache is not None:
+            self.cache.write(json.dumps(headlines).encode(), name)
+        return headlines
+
+
+class FixtureHeadlines(HeadlineProvider):
+    """
+    Headlines read from a JSON file mapping ISO dates to lists of headlines, for offline and test runs.
+    Dates missing from the file fall back to the "default" entry, if there is one.
+    """
+    def __init__(self, path):
+        super().__init__()
+        with open(path, encoding="utf-8") as file:
+            self.fixture = json.load(file)
+
+    def _lookup(self, date):
+        return self.fixture.get(date.isoformat(), self.fixture.get("default", []))
+
+
+_provider = None
+_provider_settings = dict()
+
+
+def configure_headlines(cache_dir=None, offline=False, fixture=None):
+    global _provider
+    _provider_settings.update(cache_dir=cache_dir, offline=offline, fixture=fixture)
+    _provider = None
+
+
+def get_headline_provider():
+    global _provider
+    if _provider is None:
+        if _provider_settings.get("fixture") is not None:
+            _provider = FixtureHeadlines(_provider_settings["fixture"])
+        else:
+            cache_dir = _provider_settings.get("cache_dir")
+            _provider = GoogleNewsHeadlines(Path(cache_dir) / "news" if cache_dir is not None else None,
+                                            offline=_provider_settings.get("offline", False))
+    return _provider
+
+
+def ensure_vader_lexicon():
+    # Download once at startup in the main process, never from inside a worker
+    import nltk
+    try:
+        nltk.data.find("sentiment/vader_lexicon.zip")
+    except LookupError:
+        nltk.download("vader_lexicon")
+
+
+_sia = None
+_sia_lock = threading.Lock()
+
+
+def get_sia():
+    # The analyser loads the VADER lexicon from disk, so build it once per process
+    global _sia
+    with _sia_lock:
+        if _sia is None:
+            from nltk.sentiment import SentimentIntensityAnalyzer
+            _sia = SentimentIntensityAnalyzer()
+    return _sia
+
+
+@functools.lru_cache(maxsize=4096)
+def headline_score(headline):
+    return get_sia().polarity_scores(headline)['compound']
+
+
+def headline_weights(headlines):
+    # Positive headlines are more likely to be picked
+    return np.fromiter(map(headline_score, headlines), dtype=float, count=len(headlines)) + 1
+
+
+def pick_headline(headlines, weights=None, rng=random):
+    if len(headlines) == 0:
+        return ""
+    if weights is None:
+        weights = headline_weights(headlines)
+    return rng.choices(headlines, weights=weights, k=1)[0]
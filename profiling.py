@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import functools
+import contextlib
+from pathlib import Path
+
+import numpy as np
+
+
+# perf_counter has no fixed reference point, so tie it to the wall clock once per process
+# to line up the events from different workers on one timeline
+_EPOCH_NS = time.time_ns() - time.perf_counter_ns()
+
+
+class Profiler:
+    """
+    Records the wall and CPU time of named stages in this process as Chrome trace events.
+    Events are appended to a file per process in trace_dir, so that the main process can merge
+    everything the workers recorded at the end of the run.
+    """
+    def __init__(self, trace_dir):
+        self.trace_dir = Path(trace_dir)
+        self.trace_dir.mkdir(parents=True, exist_ok=True)
+        self.pid = os.getpid()
+        self.events = []
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        start, cpu_start = time.perf_counter_ns(), time.thread_time_ns()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter_ns() - start
+            cpu = time.thread_time_ns() - cpu_start
+            tid = threading.get_native_id()
+            event = {"name": name, "ph": "X", "pid": self.pid, "tid": tid,
+                     "ts": (_EPOCH_NS + start) / 1000, "dur": wall / 1000,
+                     "args": {"cpu_ms": cpu / 1e6, **args}}
+            with self.lock:
+                if tid not in self.threads:
+                    self.threads.add(tid)
+                    self.events.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                                        "args": {"name": threading.current_thread().name}})
+                self.events.append(event)
+
+    def flush(self):
+        with self.lock:
+            events, self.events = self.events, []
+        if events:
+            with open(self.trace_dir / f"{self.pid}.jsonl", "a", encoding="utf-8") as file:
+                file.writelines(json.dumps(event) + "\n" for event in events)
+
+
+_profiler = None
+_trace_dir = None
+
+
+def configure_profiler(trace_dir=None):
+    # Called in the main process and as part of the pool initialiser, like configure_fetcher
+    global _profiler, _trace_dir
+    _trace_dir = trace_dir
+    _profiler = None
+
+
+def get_profiler():
+    # None unless profiling is on. Forked workers must not keep the parent's unflushed events
+    global _profiler
+    if _trace_dir is None:
+        return None
+    if _profiler is None or _profiler.pid != os.getpid():
+        _profiler = Profiler(_trace_dir)
+    return _profiler
+
+
+def make_trace_dir():
+    return Path(tempfile.mkdtemp(prefix="crossword-trace-"))
+
+
+def stage(name, **args):
+    profiler = get_profiler()
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name, **args)
+
+
+def timed(name):
+    # Decorator version of stage
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def flush():
+    profiler = get_profiler()
+    if profiler is not None:
+        profiler.flush()
+
+
+def write_trace(path):
+    """
+    Merge the events recorded by every process into a Chrome trace / Perfetto JSON file at path
+    and remove the per-process files.
+
+    Returns:
+        The list of merged trace events.
+    """
+    flush()
+    events = []
+    for part in sorted(Path(_trace_dir).glob("*.jsonl")):
+        with open(part, encoding="utf-8") as file:
+            events.extend(json.loads(line) for line in file)
+
+    main_pid = os.getpid()
+    pids = sorted({event["pid"] for event in events}, key=lambda pid: (pid != main_pid, pid))
+    for i, pid in enumerate(pids):
+        name = "main" if pid == main_pid else f"worker {i}"
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": name}})
+
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+    shutil.rmtree(_trace_dir, ignore_errors=True)
+    return events
+
+
+def summary(events):
+    # Table of wall and CPU time percentiles per stage, slowest stages first
+    stages = dict()
+    names = dict()
+    for event in events:
+        if event["ph"] == "X":
+            stages.setdefault(event["name"], []).append((event["dur"] / 1000, event["args"]["cpu_ms"]))
+        elif event["name"] == "process_name":
+            names[event["pid"]] = event["args"]["name"]
+
+    rows = []
+    for name, times in stages.items():
+        wall, cpu = np.array(times).T
+        rows.append((name, len(times), *np.percentile(wall, [50, 95]), *np.percentile(cpu, [50, 95]), wall.sum()))
+    rows.sort(key=lambda row: -row[-1])
+
+    lines = [f"{'stage':<16}{'count':>7}{'wall p50':>11}{'wall p95':>11}{'cpu p50':>11}{'cpu p95':>11}{'total':>11}"]
+    for name, count, w50, w95, c50, c95, total in rows:
+        lines.append(f"{name:<16}{count:>7}{w50:>9.1f}ms{w95:>9.1f}ms{c50:>9.1f}ms{c95:>9.1f}ms{total/1000:>10.2f}s")
+
+    # Busy time per process, to show how evenly the pages were spread over the workers
+    lines.append("")
+    lines.append(f"{'process':<16}{'pages':>7}{'wall':>11}{'cpu':>11}")
+    for pid, name in names.items():
+        pages = [event for event in events if event["ph"] == "X" and event["pid"] == pid and event["name"] == "page"]
+        if not pages:
+            continue
+        wall = sum(event["dur"] for event in pages) / 1e6
+        cpu = sum(event["args"]["cpu_ms"] for event in pages) / 1000
+        lines.append(f"{name:<16}{len(pages):>7}{wall:>10.2f}s{cpu:>10.2f}s")
+    return "\n".join(lines)
@@ -0,0 +1,161 @@
+import os
+import time
+import random
+import threading
+import datetime as dt
+from email.utils import parsedate_to_datetime
+
+import requests
+
+
+# Responses that mean "try again later" rather than "this page does not exist"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+
+class RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - dt.datetime.now(dt.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit for one host, adjusted AIMD style. Every request that comes back in good time
+    raises the limit by 1/limit, so about one more request per round trip. An error, a throttling
+    response or a request much slower than the host's usual latency halves it, at most once per
+    round trip so that a burst of failures from the same round only counts once.
+    """
+    def __init__(self, initial=4, minimum=1, maximum=16, slow=3):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.slow = slow
+        self.in_flight = 0
+        self.latency = None
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, ok=True, latency=None):
+        with self.condition:
+            self.in_flight -= 1
+            if ok and latency is not None:
+                if self.latency is not None and latency > self.slow * self.latency:
+                    self._decrease()
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                # Moving average of the latency, which adapts slowly so that one slow request stands out
+                self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+            elif not ok:
+                self._decrease()
+            self.condition.notify_all()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self.last_decrease > (self.latency or 0):
+            self.limit = max(self.minimum, self.limit / 2)
+            self.last_decrease = now
+
+
+class RetryPolicy:
+    def __init__(self, retries=5, backoff=0.5, max_backoff=60, rng=random):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rng = rng
+
+    def delay(self, attempt, retry_after=None):
+        # The server's Retry-After wins, otherwise exponential backoff with full jitter
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return self.rng.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+
+class HostScheduler:
+    """
+    Runs requests under a per-host AdaptiveLimit and retries the ones that fail for a reason that
+    may go away: timeouts, dropped connections and RetryableErrors (eg. 429 and 5xx responses).
+    """
+    def __init__(self, max_connections=16, initial_connections=4, retry_policy=None, sleep=time.sleep):
+        self.max_connections = max_connections
+        self.initial_connections = initial_connections
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.sleep = sleep
+        self.limits = dict()
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def limit(self, host):
+        with self.lock:
+            if host not in self.limits:
+                self.limits[host] = AdaptiveLimit(min(self.initial_connections, self.max_connections),
+                                                  maximum=self.max_connections)
+            return self.limits[host]
+
+    def run(self, host, func, transient=TRANSIENT_ERRORS):
+        limit = self.limit(host)
+        for attempt in range(self.retry_policy.retries + 1):
+            limit.acquire()
+            start = time.perf_counter()
+            try:
+                result = func()
+            except RetryableError as e:
+                limit.release(ok=False)
+                error, retry_after = e, parse_retry_after(e.retry_after)
+            except transient as e:
+                limit.release(ok=False)
+                error, retry_after = e, None
+            except BaseException:
+                # Not the host's fault, so it does not change the limit
+                limit.release()
+                raise
+            else:
+                limit.release(ok=True, latency=time.perf_counter() - start)
+                return result
+            if attempt < self.retry_policy.retries:
+                self.sleep(self.retry_policy.delay(attempt, retry_after))
+        raise error
+
+
+_scheduler = None
+_scheduler_settings = dict()
+
+
+def configure_scheduler(max_connections=16, retries=5, timeout=30):
+    global _scheduler
+    _scheduler_settings.update(max_connections=max_connections, retries=retries, timeout=timeout)
+    _scheduler = None
+
+
+def get_scheduler():
+    # Shared by every fetch thread in the process, so that the limits see all the traffic to a host.
+    # Locks must not be shared across processes, so a forked worker builds its own
+    global _scheduler
+    if _scheduler is None or _scheduler.pid != os.getpid():
+        _scheduler = HostScheduler(_scheduler_settings.get("max_connections", 16),
+                                   retry_policy=RetryPolicy(_scheduler_settings.get("retries", 5)))
+    return _scheduler
+
+
+def get_timeout():
+    return _scheduler_settings.get("timeout", 30)
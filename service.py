@@ -0,0 +1,324 @@
+"""
+Long-running generation service. The heavy imports, the fonts and a pool of render workers are set
+up once at startup, so a request only waits for its pages to be fetched and rendered.
+
+    python service.py --port 8080
+    curl -o crosswords.pdf "http://127.0.0.1:8080/pdf?from=17000&to=17004&left_handed=1"
+    curl http://127.0.0.1:8080/metrics
+
+/pdf takes from and either to (exclusive) or number (default 1). Pages are streamed back with
+chunked transfer encoding as they are finished, except with --single-document, which is laid out
+in full before it is sent. /metrics reports the requests being served and waiting, and the pages
+waiting in the render pool, in the Prometheus text format.
+"""
+import io
+import sys
+import time
+import signal
+import argparse
+import threading
+from functools import partial
+from urllib.parse import urlsplit, parse_qs
+from multiprocessing import Pool, cpu_count
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import main
+from dates import get_date_index
+from news import ensure_vader_lexicon, get_sia
+
+
+# (name, type, help) of everything /metrics reports
+METRICS = (
+    ("requests_active", "gauge", "Requests generating a PDF right now"),
+    ("requests_waiting", "gauge", "Requests waiting for one of the --max-requests slots"),
+    ("pages_queued", "gauge", "Pages handed to the render pool and not yet finished"),
+    ("workers", "gauge", "Render worker processes"),
+    ("requests_total", "counter", "PDF requests served, including failed ones"),
+    ("requests_failed_total", "counter", "PDF requests that failed"),
+    ("request_seconds_total", "counter", "Time spent generating PDFs"),
+    ("pages_rendered_total", "counter", "Pages rendered by the pool"),
+    ("pages_failed_total", "counter", "Pages that could not be fetched or rendered"),
+)
+
+
+class Metrics:
+    def __init__(self, prefix="crossword"):
+        self.prefix = prefix
+        self.values = {name: 0 for name, _, _ in METRICS}
+        self.lock = threading.Lock()
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.values[name] += amount
+
+    def set(self, name, value):
+        with self.lock:
+            self.values[name] = value
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+        lines = []
+        for name, kind, help_text in METRICS:
+            lines += [f"# HELP {self.prefix}_{name} {help_text}", f"# TYPE {self.prefix}_{name} {kind}",
+                      f"{self.prefix}_{name} {values[name]:g}"]
+        return "\n".join(lines) + "\n"
+
+
+class MeteredPool:
+    # Stands in for the Pool in generate_pages, counting the pages queued in it
+    def __init__(self, pool, metrics):
+        self.pool = pool
+        self.metrics = metrics
+
+    def apply_async(self, func, args=(), callback=None, error_callback=None):
+        def done(result):
+            self.metrics.add("pages_queued", -1)
+            self.metrics.add("pages_rendered_total")
+            callback(result)
+
+        def failed(error):
+            self.metrics.add("pages_queued", -1)
+            error_callback(error)
+
+        self.metrics.add("pages_queued")
+        return self.pool.apply_async(func, args, callback=done, error_callback=failed)
+
+
+class PagesFailed(Exception):
+    def __init__(self, failed):
+        super().__init__(", ".join(f"#{item.number}: {type(item.error).__name__}: {item.error}" for item in failed))
+        self.failed = failed
+
+
+class ChunkedWriter:
+    # File for the body of a chunked HTTP/1.1 response, sending a chunk every size bytes and on flush
+    def __init__(self, file, size=64 * 1024):
+        self.file = file
+        self.size = size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(f"{len(self.buffer):x}\r\n".encode() + self.buffer + b"\r\n")
+            self.buffer.clear()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.write(b"0\r\n\r\n")
+        self.file.flush()
+
+
+class GenerationService:
+    """
+    Builds PDFs on a warm pool of render workers, with at most max_requests being generated at
+    once. The others wait their turn, so a burst of requests cannot swamp the pool or the Guardian.
+    """
+    def __init__(self, args, processes=None, max_requests=4, max_pages=100):
+        self.args = args
+        self.max_pages = max_pages
+        self.metrics = Metrics()
+        self.slots = threading.Semaphore(max_requests)
+
+        initargs = main.worker_initargs(args, main.get_page_options(args))
+        main.init_worker(*initargs)
+        if not args["offline"]:
+            ensure_vader_lexicon()
+        get_sia()
+        self.processes = processes or cpu_count()
+        self.pool = Pool(processes=self.processes, initializer=main.init_worker, initargs=initargs)
+        self.metrics.set("workers", self.processes)
+
+    def generate(self, numbers, right_handed=True, open_output=io.BytesIO):
+        """
+        Write the PDF of the given crosswords, in order, to the file open_output(length) returns.
+        Per-page PDFs are streamed: open_output() is called as soon as the first page is ready and
+        each page is written as it comes. A single document is only complete once every page is
+        laid out, so open_output is then called with its length at the end.
+
+        Raises:
+            PagesFailed if any page could not be fetched or rendered, in which case some pages
+            may have been written already.
+        """
+        self.metrics.add("requests_waiting")
+        with self.slots:
+            self.metrics.add("requests_waiting", -1)
+            self.metrics.add("requests_active")
+            start = time.perf_counter()
+            try:
+                self._generate(numbers, right_handed, open_output)
+            except Exception:
+                self.metrics.add("requests_failed_total")
+                raise
+            finally:
+                self.metrics.add("requests_active", -1)
+                self.metrics.add("requests_total")
+                self.metrics.add("request_seconds_total", time.perf_counter() - start)
+
+    def _generate(self, numbers, right_handed, open_output):
+        args = self.args
+        single_document = args["single_document"]
+        get_date_index().resolve(numbers, main.fetch_date)
+        options = main.get_page_options(args, right_handed)
+        if single_document:
+            render = partial(main.render_page_content, **options)
+            buffer = io.BytesIO()
+            writer = main.PageWriter(buffer, True, **options)
+        else:
+            render = partial(main.render_single_page, **options)
+            output = writer = None
+
+        failed = []
+        lost = None
+        # Every page is seen through, even after a failure, so that no fetch thread is left waiting
+        pages = main.generate_pages(numbers, MeteredPool(self.pool, self.metrics), render,
+                                    fetch_threads=args["fetch_threads"],
+                                    max_pending=max(2*self.processes, args["fetch_threads"]), ordered=True, keep_going=True)
+        for item in pages:
+            if isinstance(item, main.PageFailed):
+                failed.append(item)
+                self.metrics.add("pages_failed_total")
+            elif failed or lost:
+                continue
+            elif single_document:
+                writer.add(item[1])
+            else:
+                try:
+                    if writer is None:
+                        output = open_output()
+                        writer = main.PageWriter(output, **options)
+                    writer.add(item[1])
+                    output.flush()
+                except OSError as e:
+                    # The client has gone, so the rest of the pages are only drained
+                    lost = e
+        if lost:
+            raise lost
+        if failed:
+            raise PagesFailed(failed)
+
+        if single_document:
+            writer.close()
+            output = open_output(buffer.getbuffer().nbytes)
+            output.write(buffer.getbuffer())
+        else:
+            writer.close()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    # Chunked responses need HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/pdf":
+            self.send_pdf(parse_qs(url.query))
+        elif url.path == "/metrics":
+            self.send_body(200, "text/plain; version=0.0.4", self.server.service.metrics.render().encode())
+        else:
+            self.send_error(404)
+
+    def send_pdf(self, query):
+        service = self.server.service
+        try:
+            numbers = parse_range(query, service.max_pages)
+            right_handed = query.get("left_handed", ["0"])[-1].lower() not in ("1", "true", "yes")
+        except ValueError as e:
+            self.send_body(400, "text/plain", f"{e}\n".encode())
+            return
+
+        stream = None
+
+        def open_output(length=None):
+            # Called once the PDF is under way, with its length if it is already known
+            nonlocal stream
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Disposition", f'attachment; filename="{numbers.start}_{numbers.stop}.pdf"')
+            if length is None:
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                stream = ChunkedWriter(self.wfile)
+                return stream
+            self.send_header("Content-Length", str(length))
+            self.end_headers()
+            stream = self.wfile
+            return stream
+
+        try:
+            service.generate(numbers, right_handed, open_output)
+        except Exception as e:
+            if stream is not None:
+                # Too late for an error status, so cut the response short for the client to notice
+                self.close_connection = True
+                self.log_error("Stopped sending %s_%s.pdf: %s", numbers.start, numbers.stop, e)
+            elif isinstance(e, PagesFailed):
+                self.send_body(502, "text/plain", f"Pages failed: {e}\n".encode())
+            else:
+                self.send_body(500, "text/plain", f"{type(e).__name__}: {e}\n".encode())
+            return
+        if isinstance(stream, ChunkedWriter):
+            stream.close()
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def parse_range(query, max_pages):
+    # from, and to (exclusive) or number, as a range of crossword numbers
+    def get(name, default=None):
+        if name not in query:
+            if default is None:
+                raise ValueError(f"{name} is required")
+            return default
+        try:
+            return int(query[name][-1])
+        except ValueError:
+            raise ValueError(f"{name} must be a whole number")
+
+    start = get("from")
+    stop = get("to") if "to" in query else start + get("number", 1)
+    if not 0 < stop - start <= max_pages:
+        raise ValueError(f"Ask for between 1 and {max_pages} crosswords")
+    return range(start, stop)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve PDFs of the Guardian Quick crossword over HTTP, from a warm pool of workers.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default 127.0.0.1, ie. this machine only)")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default 8080)")
+    parser.add_argument("--processes", type=int, default=None, help="Number of render worker processes (default is the number of CPUs)")
+    parser.add_argument("--max-requests", type=int, default=4, help="Requests to generate at once. The others wait their turn (default 4)")
+    parser.add_argument("--max-pages", type=int, default=100, help="Most crosswords one request can ask for (default 100)")
+    main.add_page_arguments(parser)
+    args = parser.parse_args()
+
+    service = GenerationService(main.page_settings(args), args.processes, args.max_requests, args.max_pages)
+    httpd = ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+    httpd.daemon_threads = True
+    httpd.service = service
+    # Shut down the same way on kill as on Ctrl+C, taking the workers with it
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Serving on http://{args.host}:{httpd.server_port}/pdf?from=NUMBER&to=NUMBER")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.close()
@@ -0,0 +1,47 @@
+import datetime as dt
+
+import numpy as np
+
+from archive import PuzzleArchive, PuzzleRecord, write_archive
+
+
+def record(number, clues):
+    mask = np.array([[1, 1, 1], [1, 0, 1], [1, 1, 1]], dtype=bool)
+    cell_numbers = np.array([[1, 0, 2], [0, 0, 0], [3, 0, 0]], dtype=np.uint16)
+    return PuzzleRecord(number, dt.datetime(2025, 1, 6), mask, cell_numbers, [clue[:4] for clue in clues],
+                        [clue[4] for clue in clues], [clue[5] for clue in clues])
+
+
+def test_round_trip_keeps_whole_delimiters(tmp_path):
+    clues = [("1", "across", "Café & bar", "(3)", [3], []),
+             ("3", "across", "Spaced out", "(1, 2)", [1, 2], [", "]),
+             ("1", "down", "Three ways", "(1-1 1)", [1, 1, 1], ["-", " "])]
+    path = tmp_path / "puzzles.gqpa"
+    write_archive(path, [record(17001, clues[:1]), record(17000, clues)])
+
+    with PuzzleArchive(path) as archive:
+        assert len(archive) == 2 and 17000 in archive and 17002 not in archive
+        loaded = archive[17000]
+    assert loaded.clues == [clue[:4] for clue in clues]
+    assert loaded.lengths == [[3], [1, 2], [1, 1, 1]]
+    assert loaded.delimiters == [[], [", "], ["-", " "]]
+    assert loaded.date == dt.datetime(2025, 1, 6)
+    # Copied out of the mapping, so still readable after the archive is closed
+    assert loaded.mask.tolist() == [[True, True, True], [True, False, True], [True, True, True]]
+    assert loaded.cell_numbers[2, 0] == 3
+
+
+def test_rewrite_after_close(tmp_path):
+    path = tmp_path / "puzzles.gqpa"
+    write_archive(path, [record(17000, [])])
+    archive = PuzzleArchive(path)
+    records = [*archive]
+    archive.close()
+    write_archive(path, [*records, record(17001, [])])
+    with PuzzleArchive(path) as archive:
+        assert [r.number for r in archive] == [17000, 17001]
+
+
+def test_missing_file_is_empty(tmp_path):
+    with PuzzleArchive(tmp_path / "none.gqpa") as archive:
+        assert len(archive) == 0 and list(archive) == []
@@ -0,0 +1,50 @@
+import random
+import datetime as dt
+
+import dates
+
+
+def walk(date, days):
+    # advance the slow way, one calendar day at a time
+    step = dt.timedelta(days=1 if days > 0 else -1)
+    for _ in range(abs(days)):
+        date += step
+        while not dates.is_publishing_day(date):
+            date += step
+    return date
+
+
+def test_advance_matches_walking_the_calendar():
+    rng = random.Random(0)
+    for _ in range(5000):
+        date = dt.datetime(2000, 1, 1) + dt.timedelta(days=rng.randrange(10000))
+        days = rng.randint(-1000, 1000)
+        assert dates.advance(date, days) == walk(date, days)
+
+
+def test_publishing_days_skips_sundays_and_christmas():
+    # Mon 22 Dec 2025 to Mon 29 Dec 2025: Tue to Sat less Christmas Day, then Monday
+    assert dates.publishing_days(dt.date(2025, 12, 22), dt.date(2025, 12, 29)) == 5
+
+
+def test_lookup_only_between_anchors_that_join_up():
+    index = dates.DateIndex()
+    index.add(17000, dt.datetime(2025, 1, 6))
+    index.add(17012, dt.datetime(2025, 1, 20))
+    assert index.lookup(17007) == dt.datetime(2025, 1, 14)
+    assert index.lookup(17013) is None
+    # A skipped day between the anchors means the numbers in between cannot be trusted
+    index.add(17024, dt.datetime(2025, 2, 4))
+    assert index.lookup(17018) is None
+
+
+def test_resolve_fetches_only_the_ends_of_a_gapless_range():
+    fetched = []
+
+    def fetch_date(number):
+        fetched.append(number)
+        return dates.advance(dt.datetime(2025, 1, 6), number - 17000)
+
+    resolved = dates.DateIndex().resolve(range(17000, 18000), fetch_date)
+    assert sorted(fetched) == [17000, 17999]
+    assert resolved[17500] == dates.advance(dt.datetime(2025, 1, 6), 500)
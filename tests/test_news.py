@@ -0,0 +1,23 @@
+import datetime as dt
+
+from news import HeadlineProvider
+
+
+class Flaky(HeadlineProvider):
+    # Fails the first lookup, as GoogleNewsHeadlines does when every retry does
+    def __init__(self):
+        super().__init__()
+        self.lookups = 0
+
+    def _lookup(self, date):
+        self.lookups += 1
+        return None if self.lookups == 1 else [f"News on {date}"]
+
+
+def test_failed_lookup_is_retried():
+    provider = Flaky()
+    date = dt.date(2025, 1, 6)
+    assert provider.headlines(date) == []
+    assert provider.headlines(date) == ["News on 2025-01-06"]
+    assert provider.headlines(dt.datetime(2025, 1, 6, 12)) == ["News on 2025-01-06"]
+    assert provider.lookups == 2
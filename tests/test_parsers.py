@@ -0,0 +1,84 @@
+"""
+The targeted lxml parse must give the same puzzle as the full bs4 parse it falls back to. Every
+page pair recorded with benchmarks/fixtures.py is checked, along with a synthetic pair and a page
+of HTML quirks (entities, nested tags, an upper case SVG, stray whitespace) the two could disagree on.
+"""
+import datetime as dt
+
+import numpy as np
+import pytest
+
+import main
+import fixtures
+
+
+QUIRKS_PRINT = """<!DOCTYPE html>
+<html><head><title>Quick crossword No 17,000 | The Guardian</title></head>
+<body><nav class="cells-menu"><a href="/">Home</a></nav>
+<div class="printable-crossword">
+  <SVG viewBox="0 0 93 93" class="crossword__grid">
+    <g class="cells">
+      <g><rect x="0" y="0" width="31" height="31"></rect><text x="1" y="9">1</text></g>
+      <rect x="31" y="0" width="31" height="31"></rect>
+      <g><rect x="62" y="0" width="31" height="31"></rect><text x="63" y="9">2</text></g>
+      <rect x="0" y="31" width="31" height="31"></rect>
+      <rect x="62" y="31" width="31" height="31"></rect>
+      <g><rect x="0" y="62" width="31" height="31"></rect><text x="1" y="71">3</text></g>
+      <rect x="31" y="62" width="31" height="31"></rect>
+      <rect x="62" y="62" width="31" height="31"></rect>
+    </g>
+  </SVG>
+  <div class="printable-crossword__clues clues--across"><h3>Across</h3><ol>
+    <li><span class="printable-crossword__clue__number">1</span><span>Caf&eacute; &amp; bar&nbsp;&#8212; <i>open</i> (3)</span></li>
+    <li><span class="printable-crossword__clue__number">3</span><span>Ends – with a dash (1-2)</span></li>
+  </ol></div>
+  <div class="printable-crossword__clues clues--down"><h3>Down</h3><ol>
+    <li><span class="printable-crossword__clue__number">1</span>
+        <span>Top to bottom, see 2 (2,1)</span></li>
+    <li><span class="printable-crossword__clue__number">2</span><span>No enumeration</span></li>
+  </ol></div>
+</div></body></html>"""
+
+QUIRKS_WEB = """<!DOCTYPE html><html><body>
+<div data-gu-name="dateline"><details><summary>
+  <span>Mon 6 Jan 2025 00.00 GMT</span>
+</summary></details></div></body></html>"""
+
+
+def page_pairs():
+    recorded = sorted(fixtures.PAGES.glob("*/print.html")) if fixtures.PAGES.exists() else []
+    pairs = [pytest.param(int(path.parent.name), path.read_text(encoding="utf-8"),
+                          (path.parent / "web.html").read_text(encoding="utf-8"), id=f"recorded-{path.parent.name}")
+             for path in recorded]
+    number = fixtures.ANCHOR_NUMBER
+    pairs.append(pytest.param(number, fixtures.synthetic_print_html(number), fixtures.synthetic_web_html(number),
+                              id="synthetic"))
+    pairs.append(pytest.param(number, QUIRKS_PRINT, QUIRKS_WEB, id="quirks"))
+    return pairs
+
+
+def summary(puzzle):
+    clues = [(c.number, c.direction, c.text, c.num_letters, c.lengths, c.delimiters) for c in puzzle.across + puzzle.down]
+    return puzzle.date, clues, puzzle.mask.tolist(), puzzle.cell_numbers.tolist()
+
+
+@pytest.mark.parametrize("number, print_html, web_html", page_pairs())
+def test_targeted_parse_matches_full_parse(monkeypatch, number, print_html, web_html):
+    assert main.extract_guardian_parts(print_html) is not None
+    targeted = main.Puzzle.from_guardian_html(number, print_html, web_html)
+
+    # Without an lxml tree both the puzzle and the dateline come from bs4 over the whole page
+    monkeypatch.setattr(main, "parse_html", lambda html: None)
+    full = main.Puzzle.from_guardian_html(number, print_html, web_html)
+
+    assert summary(targeted) == summary(full)
+    assert targeted.across and targeted.down
+
+
+def test_quirks_page():
+    puzzle = main.Puzzle.from_guardian_html(17000, QUIRKS_PRINT, QUIRKS_WEB)
+    assert puzzle.date == dt.datetime(2025, 1, 6)
+    assert [c.text for c in puzzle.across] == ["Café & bar\xa0- open", "Ends - with a dash"]
+    assert [c.num_letters for c in puzzle.down] == ["(2,1)", ""]
+    assert puzzle.mask.tolist() == [[True, True, True], [True, False, True], [True, True, True]]
+    assert np.array_equal(puzzle.cell_numbers, [[1, 0, 2], [0, 0, 0], [3, 0, 0]])
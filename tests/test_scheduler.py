@@ -0,0 +1,114 @@
+"""
+The scheduler against the benchmarks' stand-in for the Guardian, which can be made slow, throttle
+with 429 and Retry-After, or fail with 503.
+"""
+import threading
+
+import pytest
+import requests
+
+from fetch import Fetcher, TimedSession
+from scheduler import AdaptiveLimit, HostScheduler, RetryableError, RetryPolicy, parse_retry_after
+from server import StandInServer
+
+
+HOST = "stand-in"
+
+
+def scheduler(retries=2, sleeps=None, **kwargs):
+    # Records the waits between retries instead of sleeping through them
+    return HostScheduler(retry_policy=RetryPolicy(retries), sleep=(sleeps if sleeps is not None else []).append, **kwargs)
+
+
+def get(server, scheduler, number=17000):
+    fetcher = Fetcher(scheduler=scheduler, timeout=5)
+    try:
+        return scheduler.run(HOST, lambda: fetcher.request(server.url.format(number=number), dict()))
+    finally:
+        fetcher.close()
+
+
+def test_ok_responses_raise_the_limit():
+    with StandInServer() as server:
+        hosts = scheduler()
+        for _ in range(10):
+            assert get(server, hosts).status_code == 200
+    assert hosts.limit(HOST).limit > hosts.initial_connections
+
+
+def test_5xx_is_retried_then_raised():
+    sleeps = []
+    with StandInServer(error_rate=1) as server:
+        hosts = scheduler(retries=2, sleeps=sleeps)
+        with pytest.raises(RetryableError, match="503"):
+            get(server, hosts)
+    # Two waits between three attempts, and the failures halve the limit
+    assert len(sleeps) == 2
+    assert hosts.limit(HOST).limit < hosts.initial_connections
+
+
+def test_429_waits_for_retry_after():
+    sleeps = []
+    # With no capacity every request is throttled with Retry-After: 1
+    with StandInServer(capacity=0) as server:
+        with pytest.raises(RetryableError, match="429"):
+            get(server, scheduler(retries=3, sleeps=sleeps))
+    assert sleeps == [1, 1, 1]
+
+
+def test_timeout_is_retried():
+    sleeps = []
+    with StandInServer(latency=0.5) as server:
+        fetcher = Fetcher(timeout=0.05)
+        with pytest.raises(requests.Timeout):
+            scheduler(retries=1, sleeps=sleeps).run(HOST, lambda: fetcher.request(server.url.format(number=17000), dict()))
+        fetcher.close()
+    assert len(sleeps) == 1
+
+
+def test_limit_keeps_within_the_server_capacity():
+    # No retries, so a single 429 would fail a request
+    with StandInServer(latency=0.02, capacity=2) as server:
+        hosts = scheduler(retries=0, max_connections=2, initial_connections=2)
+        errors = []
+
+        def worker():
+            try:
+                for number in range(17000, 17005):
+                    get(server, hosts, number)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert errors == []
+
+
+def test_timed_session_has_a_default_timeout():
+    with StandInServer(latency=0.5) as server:
+        with TimedSession(timeout=0.05) as session:
+            with pytest.raises(requests.Timeout):
+                session.get(server.url.format(number=17000))
+
+
+def test_adaptive_limit_halves_once_per_round_trip():
+    limit = AdaptiveLimit(initial=8)
+    limit.latency = 60
+    for _ in range(3):
+        limit.acquire()
+    for _ in range(3):
+        limit.release(ok=False)
+    assert limit.limit == 4
+
+
+def test_retry_policy():
+    policy = RetryPolicy(backoff=0.5, max_backoff=10)
+    assert policy.delay(0, retry_after=3) == 3
+    assert policy.delay(0, retry_after=120) == 10
+    assert all(0 <= policy.delay(attempt) <= min(10, 0.5 * 2**attempt) for attempt in range(8) for _ in range(20))
+    assert parse_retry_after("2") == 2
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after("soon") is None
@@ -0,0 +1,101 @@
+"""
+ServiceHandler over a stand-in for GenerationService, checking how a PDF is sent: chunked as the
+pages come, with a length when it is known up front, and what the client sees when pages fail.
+"""
+import threading
+import http.client
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import service
+
+
+class StandInService:
+    max_pages = 10
+
+    def __init__(self, pages, fail=False, length=False):
+        self.pages = pages
+        self.fail = fail
+        self.length = length
+        self.metrics = service.Metrics()
+
+    def generate(self, numbers, right_handed=True, open_output=None):
+        body = b"".join(self.pages)
+        output = open_output(len(body)) if self.length and self.pages else None
+        for page in self.pages:
+            if output is None:
+                output = open_output()
+            if not self.length:
+                output.write(page)
+                output.flush()
+        if self.length:
+            output.write(body)
+        if self.fail:
+            raise service.PagesFailed([])
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(stand_in):
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), service.ServiceHandler)
+        httpd.daemon_threads = True
+        httpd.service = stand_in
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        connection = http.client.HTTPConnection("127.0.0.1", httpd.server_port, timeout=5)
+        connection.request("GET", "/pdf?from=17000&number=2")
+        return connection.getresponse()
+
+    yield start
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_pages_are_chunked(serve):
+    response = serve(StandInService([b"%PDF page one ", b"page two"]))
+    assert response.status == 200
+    assert response.getheader("Transfer-Encoding") == "chunked"
+    assert response.read() == b"%PDF page one page two"
+
+
+def test_known_length_is_sent(serve):
+    response = serve(StandInService([b"%PDF whole document"], length=True))
+    assert response.getheader("Content-Length") == str(len(b"%PDF whole document"))
+    assert response.read() == b"%PDF whole document"
+
+
+def test_failure_before_any_page_is_502(serve):
+    response = serve(StandInService([], fail=True))
+    assert response.status == 502
+
+
+def test_failure_after_streaming_cuts_the_response_short(serve):
+    response = serve(StandInService([b"%PDF page one"], fail=True))
+    assert response.status == 200
+    with pytest.raises(http.client.IncompleteRead):
+        response.read()
+
+
+def test_chunked_writer_batches_writes():
+    class Sink:
+        def __init__(self):
+            self.data = b""
+
+        def write(self, data):
+            self.data += data
+
+        def flush(self):
+            pass
+
+    sink = Sink()
+    writer = service.ChunkedWriter(sink, size=4)
+    writer.write(b"ab")
+    assert sink.data == b""
+    writer.write(b"cdef")
+    writer.write(b"g")
+    writer.close()
+    assert sink.data == b"6\r\nabcdef\r\n1\r\ng\r\n0\r\n\r\n"
@@ -1,19 +1,134 @@
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageOps, ImageChops
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageOps
+import os
+import json
+import functools
 import colorsys
+import hashlib
 import random
 import numpy as np
 from io import BytesIO
 import math
 from pathlib import Path
-import matplotlib.cm as cm
-import matplotlib.pyplot as plt
+from cache import DiskCache
 import sys
 
 
+FONT_DIRS = [
+    Path(__file__).parent / "fonts",
+    Path(R"C:\Windows\Fonts"),
+    Path.home() / "AppData/Local/Microsoft/Windows/Fonts",
+    Path("/usr/share/fonts"),
+    Path("/usr/local/share/fonts"),
+    Path.home() / ".fonts",
+    Path.home() / ".local/share/fonts",
+    Path("/Library/Fonts"),
+    Path("/System/Library/Fonts"),
+    Path.home() / "Library/Fonts",
+]
+# Where the glyph coverage is saved unless configure_font_catalogue gives a cache directory
+FONT_INDEX = Path(__file__).parent / "cache" / "font_catalogue.json"
+
+
+class FontCatalogue:
+    """
+    Index of the fonts available for WordArt and whether each one can draw every digit.
+    Glyph coverage is saved to disk so a font is only checked again if its file changes.
+
+    Parameters:
+        dirs (list): directories to search (recursively) for .ttf and .otf files.
+        index_path (Path): JSON file the coverage results are saved to, or None to not save them.
+        chars (str): characters a font must have glyphs for to be used.
+    """
+    def __init__(self, dirs=FONT_DIRS, index_path=FONT_INDEX, chars="0123456789"):
+        self.dirs = [Path(d) for d in dirs]
+        self.index_path = Path(index_path) if index_path is not None else None
+        self.chars = chars
+        self.entries = dict()
+        self.scan()
+        self.fonts = sorted(path for path, entry in self.entries.items() if entry["valid"])
+        # Changes whenever the usable fonts change, for keying caches of rendered WordArt
+        self.version = hashlib.sha1("\n".join(self.fonts).encode()).hexdigest()[:16]
+
+    def scan(self):
+        saved = dict()
+        if self.index_path is not None and self.index_path.exists():
+            with open(self.index_path) as file:
+                index = json.load(file)
+            if index.get("chars") == self.chars:
+                saved = index["fonts"]
+
+        changed = False
+        for directory in self.dirs:
+            if not directory.is_dir():
+                continue
+            for path in directory.rglob("*"):
+                if path.suffix.lower() not in (".ttf", ".otf"):
+                    continue
+                stat = path.stat()
+                entry = saved.get(str(path))
+                if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+                    entry = {"mtime": stat.st_mtime, "size": stat.st_size, "valid": self._covers(path)}
+                    changed = True
+                self.entries[str(path)] = entry
+
+        if self.index_path is not None and (changed or len(saved) != len(self.entries)):
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename, as pool workers may be reading it at the same time
+            tmp = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({"chars": self.chars, "fonts": self.entries}))
+            os.replace(tmp, self.index_path)
+
+    def _covers(self, path):
+        try:
+            font = ImageFont.truetype(path)
+        except OSError:
+            return False
+        return not any(is_missing_glyph(c, font) for c in self.chars)
+
+    def random_font(self, rng=random):
+        if len(self.fonts) == 0:
+            raise FileNotFoundError(f"No fonts with glyphs for {self.chars!r} found in {self.dirs}")
+        return self.fonts[rng.randrange(len(self.fonts))]
+
+    def default_font(self):
+        for path in self.fonts:
+            if Path(path).name.lower() == "comic.ttf":
+                return path
+        return self.random_font(random.Random(0))
+
+
+_catalogue = None
+_catalogue_index = FONT_INDEX
+
+
+def configure_font_catalogue(cache_dir=None):
+    global _catalogue, _catalogue_index
+    index = Path(cache_dir) / "font_catalogue.json" if cache_dir is not None else FONT_INDEX
+    # A worker forked after the catalogue was built keeps it, rather than reading the index again
+    if index != _catalogue_index:
+        _catalogue_index = index
+        _catalogue = None
+
+
+def get_font_catalogue():
+    # Extra font directories can be given in the WORDART_FONT_DIRS environment variable
+    global _catalogue
+    if _catalogue is None:
+        extra = [Path(d) for d in os.environ.get("WORDART_FONT_DIRS", "").split(os.pathsep) if d]
+        _catalogue = FontCatalogue(extra + FONT_DIRS, _catalogue_index)
+    return _catalogue
+
+
 class WordArt:
-    def __init__(self, string, res=300, follow_path=None, fontpath="C:\Windows\Fonts\Comic.ttf", path_kwargs=dict(), **kwargs):
+    """
+    The WordArt image is held as a single uint8 RGBA array, self.arr. Effects that keep the
+    canvas size update it in place; self.img gives a PIL view of it for everything else.
+    """
+    def __init__(self, string, res=300, follow_path=None, fontpath=None, path_kwargs=dict(), **kwargs):
         self.string = str(string)
         self.res = res
+        if fontpath is None:
+            fontpath = get_font_catalogue().default_font()
         self.font = ImageFont.truetype(fontpath, size=res)
         if follow_path is None:
             self._generate_text_mask(**kwargs)  
@@ -21,86 +136,105 @@ class WordArt:
             self._generate_text_mask_on_path(follow_path, path_kwargs=path_kwargs, **kwargs)
 
     @classmethod
-    def randomise(cls, string, seed=None, res=300,):
+    def randomise(cls, string, seed=None, res=300, shadow_quality=0.25, fit=None):
+        """
+        Make a WordArt with a random font, path, colouring, extrusion and shadow.
+
+        Parameters:
+            seed: the same string and seed always give the same WordArt. None picks a fresh random one.
+            res (int): font size in pixels. Pixel sizes of the effects are scaled to match.
+            shadow_quality (float): passed to the shadow as its quality.
+            fit (tuple): (width, height) in pixels to size the text for, overriding res.
+        """
+        rng = random.Random(f"{string}:{seed}") if seed is not None else random.Random()
+
         # Pick a random font
-        fonts = list(Path(R"C:\Windows\Fonts").glob("*.ttf"))
-        good = False
-        while not good:
-            font = random.choice(fonts)
-            good = not is_missing_glyph("1", font)
-            if not good:
-                print(f"Rejecting {font}")
+        font = get_font_catalogue().random_font(rng)
+        if fit is not None:
+            res = fit_font_size(font, string, *fit)
+        # Effect sizes below were chosen for res=300
+        px = res / 300
 
         # Pick random follow path
-        x = random.random()
+        x = rng.random()
         if x > 0.8:
-            f = random.random() * 2
-            a = random.random() / 5
+            f = rng.random() * 2
+            a = rng.random() / 5
             w = cls(string, res=res, follow_path=sine_path, fontpath=font, path_kwargs={"freq":f, "amplitude":a})
         else:
             w = cls(string, res=res, fontpath=font)
 
         # Pick random colour
-        x = random.random()
+        x = rng.random()
         gradient = x > 0.5
         if gradient:
-            cmap = random.choice(plt.colormaps())
-            direction = random.choice(["horizontal", "vertical", "radial", "diagonal"])
+            cmap = rng.choice(colormap_names())
+            direction = rng.choice(["horizontal", "vertical", "radial", "diagonal"])
             w.add_gradient(cmap, direction)
         else:
-            rgb = random_hls_in_rgb()
+            rgb = random_hls_in_rgb(rng=rng)
             w.set_colour(rgb)
 
         # extrude text?
-        x = random.random()
+        x = rng.random()
         if x > 0.5:
             extruded = True
-            depth = np.max((5, int(random.random() * 50)))
-            direction = np.array((random.random(), random.random()))
+            depth = max(1, int(np.max((5, int(rng.random() * 50))) * px))
+            direction = np.array((rng.random(), rng.random()))
             direction /= np.linalg.norm(direction)
             if gradient:
-                darken = random.random()
+                darken = rng.random()
                 colour = None
             else:
                 if x > 0.75:
                     darken = None
-                    colour = random_hls_in_rgb(l=0.4)
+                    colour = random_hls_in_rgb(l=0.4, rng=rng)
                 else:
-                    darken = random.random()
+                    darken = rng.random()
                     colour = None
             w.extrude_text(depth, direction, darken, colour)
         else:
             extruded = False
 
         # Pick random shadow type
-        x = random.random()
+        x = rng.random()
         if x < 0.33 and extruded:
             #drop shadow
-            offset_x = (random.random() - 0.5) * 100
-            offset_y = (random.random() - 0.5) * 100
-            blur_radius = random.random() * 10 + 2
-            shadow_colour = random_hls_in_rgb(s=random.random(), l=0.2)
-            w.add_drop_shadow((offset_x, offset_y), blur_radius, shadow_colour)
+            offset_x = (rng.random() - 0.5) * 100 * px
+            offset_y = (rng.random() - 0.5) * 100 * px
+            blur_radius = (rng.random() * 10 + 2) * px
+            shadow_colour = random_hls_in_rgb(s=rng.random(), l=0.2, rng=rng)
+            w.add_drop_shadow((offset_x, offset_y), blur_radius, shadow_colour, quality=shadow_quality)
         elif x < 0.67 and not extruded:
             # perspective shadow
-            shear = (random.random() - 0.5) + 1
-            vert = (random.random() - 0.5) + 1
-            blur_radius = random.random() * 4
-            shadow_colour = tuple(random_hls_in_rgb(s=random.random(), l=0.2))
-            w.add_perspective_shadow(shear, vert, shadow_colour, blur_radius)
+            shear = (rng.random() - 0.5) + 1
+            vert = (rng.random() - 0.5) + 1
+            blur_radius = rng.random() * 4 * px
+            shadow_colour = tuple(random_hls_in_rgb(s=rng.random(), l=0.2, rng=rng))
+            w.add_perspective_shadow(shear, vert, shadow_colour, blur_radius, quality=shadow_quality)
         else:
             # no shadow
             pass
 
         return w
 
+    @property
+    def img(self):
+        # Shares memory with self.arr, so it is only valid until the next effect is applied
+        return Image.fromarray(self.arr)
+
+    @img.setter
+    def img(self, image):
+        self.arr = np.array(image.convert("RGBA"))
+
     def _generate_text_mask(self):
         bbox = self.font.getbbox(self.string, anchor="lt")
         sx = (bbox[2] - bbox[0])
         sy = (bbox[3] - bbox[1])
-        self.img = Image.new("RGBA", (sx,sy), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(self.img)
+        img = Image.new("RGBA", (sx,sy), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
         draw.text((0,0), self.string, font=self.font, anchor="lt")
+        self.img = img
         self.baseline = bbox[3] - 1
         self._trim_canvas()
 
@@ -112,20 +246,18 @@ class WordArt:
             path_kwargs=dict()
     ):
         # Measure total text length
-        total_length = sum(self.font.getlength(c) for c in self.string) * spacing
+        widths = np.array([self.font.getlength(c) for c in self.string]) * spacing
+        total_length = widths.sum()
 
         # Sample points along the path to get bounding box
         n_samples = max(200, len(self.string) * 10)
-        points = []
-        for i in range(n_samples+1):
-            t = i / n_samples
-            x, y, angle = path_func(t, **path_kwargs)
-            points.append((x, y))
+        xs, ys, _ = path_func(np.linspace(0, 1, n_samples+1), **path_kwargs)
         
         # Convert unit coordinates to pixel coordinates
-        xs, ys = zip(*points)
-        min_x, max_x = min(xs), max(xs)
-        min_y, max_y = min(ys), max(ys)
+        xs = np.broadcast_to(xs, (n_samples+1,))
+        ys = np.broadcast_to(ys, (n_samples+1,))
+        min_x, max_x = xs.min(), xs.max()
+        min_y, max_y = ys.min(), ys.max()
 
         # Scale to text length in pixels
         # Scale factor to map unit length to text pixel length
@@ -142,99 +274,101 @@ class WordArt:
         # Create canvas
         img = Image.new("RGBA", (width, height), (0,0,0,0))
 
-        # Draw each character along the path
-        dist = 0
-        for ch in self.string:
-            ch_width = self.font.getlength(ch) * spacing
-            t = dist / total_length
-            x_unit, y_unit, angle = path_func(t, **path_kwargs)
-
-            # Convert to pixel coordinates
-            x_px = int((x_unit - min_x) * scale) + char_diag/2
-            y_px = int((y_unit - min_y) * scale) + char_diag/2
-
-            # Render character on its own layer
-            ch_img = Image.new("RGBA", (width, height), (0,0,0,0))
+        # Position of each character along the path, all in one call
+        n = len(self.string)
+        ts = (np.cumsum(widths) - widths) / total_length
+        x_units, y_units, angles = path_func(ts, **path_kwargs)
+        x_pxs = ((np.broadcast_to(x_units, (n,)) - min_x) * scale).astype(int) + char_diag/2
+        y_pxs = ((np.broadcast_to(y_units, (n,)) - min_y) * scale).astype(int) + char_diag/2
+        angles = np.broadcast_to(angles, (n,)) + angle_offset
+
+        # Draw each character on a canvas just big enough to rotate it, then paste it into place
+        for ch, x_px, y_px, angle in zip(self.string, x_pxs, y_pxs, angles):
+            l, t, r, b = self.font.getbbox(ch, anchor="mm")
+            half = int(math.ceil(math.hypot(max(-l, r), max(-t, b)))) + 2
+            fx, fy = x_px % 1, y_px % 1
+            centre = (half + fx, half + fy)
+
+            ch_img = Image.new("RGBA", (2*half+1, 2*half+1), (0,0,0,0))
             ch_draw = ImageDraw.Draw(ch_img)
-            ch_draw.text((x_px, y_px), ch, font=self.font, fill=(255,255,255), anchor="mm")
-            ch_img = ch_img.rotate(angle + angle_offset, center=(x_px, y_px), resample=Image.BICUBIC)
+            ch_draw.text(centre, ch, font=self.font, fill=(255,255,255), anchor="mm")
+            if angle % 360 != 0:
+                ch_img = ch_img.rotate(angle, center=centre, resample=Image.BICUBIC)
 
-            # Composite onto main image
-            img = Image.alpha_composite(img, ch_img)
-            dist += ch_width
+            # Composite onto main image, clipping the glyph canvas at the edges
+            x0, y0 = int(x_px - fx) - half, int(y_px - fy) - half
+            sx, sy = max(0, -x0), max(0, -y0)
+            ex, ey = min(ch_img.width, width - x0), min(ch_img.height, height - y0)
+            if ex > sx and ey > sy:
+                img.alpha_composite(ch_img, dest=(x0 + sx, y0 + sy), source=(sx, sy, ex, ey))
 
         # Trim excess blank space around image
         self.img = img
         self._trim_canvas()
 
     def _expand_canvas(self, factor=2):
-        width, height = self.img.size
+        height, width = self.arr.shape[:2]
         new_width = int(width * factor)
         new_height = int(height * factor)
 
-        # Create a new blank image with the same mode and white background
-        new_image = Image.new("RGBA", (new_width, new_height), (0,0,0,0))
+        # Create a new blank canvas
+        new_arr = np.zeros((new_height, new_width, 4), dtype=np.uint8)
 
         # Calculate top-left coordinates to paste original image in the center
         left = (new_width - width) // 2
         top = (new_height - height) // 2
 
-        # Paste the original image onto the new canvas
-        new_image.paste(self.img, (left, top))
+        # Copy the original image onto the new canvas
+        new_arr[top:top+height, left:left+width] = self.arr
 
         # Modify baseline location
         self.baseline += top
 
-        self.img = new_image
+        self.arr = new_arr
 
     def _trim_canvas(self):
         bbox = self.img.getbbox()
         self.baseline = bbox[3] - bbox[1] - 1
-        self.img = self.img.crop(bbox)
+        self.arr = self.arr[bbox[1]:bbox[3], bbox[0]:bbox[2]].copy()
 
     def set_colour(self, rgb):
-        arr = np.array(self.img).astype(float)
-        r, g, b, a = arr[...,0], arr[...,1], arr[...,2], arr[...,3]
-
         fr, fg, fb = rgb
         if not fr <= 1 and fg <= 1 and fb <= 1:
             factor = 255
         else:
             factor = 1
 
-        r *= fr * factor
-        g *= fg * factor
-        b *= fb * factor
+        # Scale each channel through a lookup table, in place
+        levels = np.arange(256)
+        for channel, f in enumerate((fr, fg, fb)):
+            lut = np.clip(levels * (f * factor), 0, 255).astype(np.uint8)
+            self.arr[..., channel] = lut[self.arr[..., channel]]
 
-        # clip + reassemble
-        out = np.dstack([r, g, b, a])
-        out = np.clip(out, 0, 255).astype(np.uint8)
-        self.img = Image.fromarray(out, "RGBA")
-
-    def add_perspective_shadow(self, shear_factor=1, scale_factor=1.5, shadow_colour=(0,0,0), blur_radius=5):
+    def add_perspective_shadow(self, shear_factor=1, scale_factor=1.5, shadow_colour=(0,0,0), blur_radius=5, quality=1):
         self._expand_canvas(3)
         tx = -shear_factor * self.baseline     
         ty = self.baseline * (1 - scale_factor)     
-        matrix = (1, shear_factor, tx, 0, scale_factor, ty)
 
-        sheared = self.img.transform(
-            self.img.size,
+        # Shear just the alpha mask, at the reduced scale if there is one
+        mask, k = _downscale_mask(self.img.getchannel("A"), quality, blur_radius)
+        matrix = (1, shear_factor, tx/k, 0, scale_factor, ty/k)
+        sheared = mask.transform(
+            mask.size,
             Image.AFFINE,
             matrix,
             resample=Image.BICUBIC,
-            fillcolor=(0,0,0,0)
+            fillcolor=0
         )
+        a = _blur_mask(sheared, blur_radius, k, self.img.size)
 
-        a = sheared.split()[-1]
-        shadow_img = Image.new("RGBA", sheared.size, shadow_colour + (0,))
+        shadow_img = Image.new("RGBA", self.img.size, tuple(shadow_colour[:3]))
         shadow_img.putalpha(a)
-        shadow_img = shadow_img.filter(ImageFilter.GaussianBlur(blur_radius))
 
         shadow_img.paste(self.img, (0, 0), self.img)
         self.img = shadow_img
         self._trim_canvas()
 
-    def add_drop_shadow(self, offset=(10, 20), blur_radius=5, shadow_colour=(0, 0, 0, 180)):
+    def add_drop_shadow(self, offset=(10, 20), blur_radius=5, shadow_colour=(0, 0, 0, 180), quality=1):
         """
         Adds a soft drop shadow behind the image.
         
@@ -242,18 +376,19 @@ class WordArt:
             offset (tuple): (x, y) pixel offset of the shadow relative to the image.
             blur_radius (int): how soft the shadow appears.
             shadow_colour (tuple): RGBA color of the shadow (default: semi-transparent black).
+            quality (float): scale (at most 1) the shadow is blurred at before being scaled back up.
         """
         self._expand_canvas(1.2)
         offset = [int(x) for x in offset]
 
-        # Create shadow base (just the alpha mask filled with shadow colour)
-        r, g, b, a = self.img.split()
+        # Blur just the alpha mask to soften the shadow, at the reduced scale if there is one
+        mask, k = _downscale_mask(self.img.getchannel("A"), quality, blur_radius)
+        a = _blur_mask(mask, blur_radius, k, self.img.size)
+
+        # Create shadow (the blurred alpha mask filled with shadow colour)
         shadow = Image.new("RGBA", self.img.size, tuple(shadow_colour))
         shadow.putalpha(a)
 
-        # Apply Gaussian blur to soften shadow
-        shadow = shadow.filter(ImageFilter.GaussianBlur(blur_radius))
-
         # Create a new image large enough to fit shadow + image
         width =  self.img.width + abs(offset[0])
         height = self.img.height + abs(offset[1])
@@ -271,15 +406,14 @@ class WordArt:
         self.img = combined
 
     def add_gradient(self, cmap='viridis', direction='horizontal'):
-        w, h = self.img.size
+        h, w = self.arr.shape[:2]
 
         if isinstance(cmap, str):
-            cmap = plt.get_cmap(cmap)
+            cmap = get_colormap(cmap)
 
-        # Create normalized coordinate grid
-        x = np.linspace(0, 1, w)
-        y = np.linspace(0, 1, h)
-        X, Y = np.meshgrid(x, y)
+        # Create normalized coordinates, as a row and a column that broadcast to the full grid
+        X = np.linspace(0, 1, w)[np.newaxis, :]
+        Y = np.linspace(0, 1, h)[:, np.newaxis]
 
         if direction == 'horizontal':
             gradient = X
@@ -297,36 +431,59 @@ class WordArt:
         else:
             raise ValueError("direction must be 'horizontal', 'vertical', or 'diagonal'")
 
-        # Apply the colormap and convert to RGB 0–255
-        rgba = cmap(gradient)
-        rgb = (rgba[:, :, :4] * 255).astype(np.uint8)
-        i = Image.fromarray(rgb, mode='RGBA') 
-        self.img = ImageChops.multiply(self.img, i)
+        # Look the colours up in a table of the colormap (indexed the same way the colormap does)
+        # and multiply them into the image in place, with the same integer maths as ImageChops.multiply
+        lut = (cmap(np.arange(cmap.N)) * 255).astype(np.uint8)
+        index = np.minimum((gradient * cmap.N).astype(int), cmap.N - 1)
+        product = np.multiply(self.arr, lut[index], dtype=np.uint16)
+        product //= 255
+        self.arr[...] = product
 
     def extrude_text(self, depth=10, direction=(-1,1), darken=None, colour=None):
         self._expand_canvas(1.1)
         if darken is not None and colour is not None:
             raise ValueError("Specify exactly one of darken or colour")
         
-        w, h = self.img.size
-        base = Image.new("RGBA", (w + depth, h + depth), (0, 0, 0, 0))
-        arr = np.array(self.img).astype(np.float32)
-        rgb, alpha = arr[..., :3], arr[..., -1]
-
-        for i in range(0, depth, 1):
-            if darken is not None:
-                factor = darken ** (depth - i + 1)
-                shaded_rgb = rgb * factor
-            else:
-                rgb[alpha != 0] = colour
-                shaded_rgb = rgb
-            shaded = np.concatenate([shaded_rgb, alpha[...,np.newaxis]], axis=-1).astype(np.uint8)
-            layer = Image.fromarray(shaded, "RGBA")
-            offset = (np.array(direction) / np.linalg.norm(direction) * i).astype(int).tolist()
-            base.alpha_composite(layer, offset)
+        h, w = self.arr.shape[:2]
+        rgb, alpha = self.arr[..., :3], self.arr[..., -1]
+
+        # Offset of each layer, shifted so that every layer lands inside the canvas
+        steps = np.arange(depth)[:, np.newaxis] * (np.array(direction) / np.linalg.norm(direction))
+        offsets = steps.astype(int)
+        offsets -= offsets.min(axis=0)
+        bw, bh = offsets.max(axis=0) + (w, h)
+
+        # Later layers sit on top of earlier ones, so each pixel of the body shows the last layer covering it.
+        # Build the body's alpha (stacked layers let through the product of their transparencies)
+        # and the index of that last layer
+        transparency = np.ones((bh, bw), dtype=np.float32)
+        layer_transparency = 1 - alpha.astype(np.float32) / 255
+        top = np.full((bh, bw), -1, dtype=np.int32)
+        edge = np.full((bh, bw), -1, dtype=np.int32)
+        covered, solid = alpha != 0, alpha >= 128
+        for i, (ox, oy) in enumerate(offsets):
+            transparency[oy:oy+h, ox:ox+w] *= layer_transparency
+            top[oy:oy+h, ox:ox+w][solid] = i
+            edge[oy:oy+h, ox:ox+w][covered] = i
+        # Pixels only ever touched by antialiased edges take their colour from the last edge
+        top = np.where(top >= 0, top, edge)
+        body_alpha = np.rint((1 - transparency) * 255).astype(np.uint8)
+
+        # Look up each body pixel's colour in the source image and shade it for its layer
+        ys, xs = np.nonzero(top >= 0)
+        layer = top[ys, xs]
+        body = np.zeros((bh, bw, 4), dtype=np.uint8)
+        if darken is not None:
+            factors = darken ** (depth - np.arange(depth) + 1)
+            src = rgb[ys - offsets[layer, 1], xs - offsets[layer, 0]]
+            body[ys, xs, :3] = (src * factors[layer, np.newaxis]).astype(np.uint8)
+        else:
+            body[ys, xs, :3] = colour
+        body[..., 3] = body_alpha
 
         # Front face on top
-        base.alpha_composite(self.img, offset)
+        base = Image.fromarray(body, "RGBA")
+        base.alpha_composite(self.img, tuple(offsets[-1].tolist()))
 
         self.img = base
         self._trim_canvas()
@@ -361,13 +518,90 @@ class WordArt:
 
         self.img.show()
 
-    def to_buffer(self):
+    def to_buffer(self, **save_kwargs):
         buf = BytesIO()
-        self.img.save(buf, format="PNG")   # or "JPEG" depending on image
+        self.img.save(buf, format="PNG", **save_kwargs)   # or "JPEG" depending on image
         buf.seek(0)
         return buf
 
 
+class WordArtCache(DiskCache):
+    """
+    Finished WordArt PNGs, keyed by everything that decides what randomise draws, including the
+    version of the font catalogue.
+    """
+    def key(self, string, seed, expand, kwargs):
+        parts = [str(string), seed, expand, sorted(kwargs.items()), get_font_catalogue().version]
+        return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest() + ".png"
+
+
+_wordart_cache = None
+
+
+def configure_wordart_cache(cache_dir=None, max_bytes=200*1024**2):
+    global _wordart_cache
+    _wordart_cache = WordArtCache(cache_dir, max_bytes) if cache_dir is not None else None
+
+
+def render_image(string, seed=None, expand=1, **kwargs):
+    """
+    PIL image of WordArt.randomise(string, seed, **kwargs) with its canvas expanded by expand.
+    Seeded WordArt is reproducible, so it is read from and saved to the cache when one is configured.
+    """
+    cacheable = seed is not None and _wordart_cache is not None
+    if cacheable:
+        key = _wordart_cache.key(string, seed, expand, kwargs)
+        png = _wordart_cache.read(key)
+        if png is not None:
+            return Image.open(BytesIO(png))
+
+    w = WordArt.randomise(string, seed=seed, **kwargs)
+    if expand != 1:
+        w._expand_canvas(expand)
+    # Copy, as the image is otherwise a view of the WordArt's buffer
+    img = w.img.copy()
+    if cacheable:
+        # The cache is only read back occasionally, so favour a fast save over a small file
+        _wordart_cache.write(w.to_buffer(compress_level=1).getvalue(), key)
+    return img
+
+
+@functools.lru_cache(maxsize=None)
+def colormap_names():
+    # matplotlib is slow to import and only gradients need it, so it is loaded on first use
+    import matplotlib
+    return sorted(matplotlib.colormaps)
+
+
+def get_colormap(name):
+    import matplotlib
+    return matplotlib.colormaps[name]
+
+
+def fit_font_size(fontpath, string, width, height, headroom=0.7):
+    # Largest font size at which the plain text takes up at most headroom of the box, leaving space for effects
+    ref = 100
+    bbox = ImageFont.truetype(fontpath, size=ref).getbbox(str(string), anchor="lt")
+    scale = min(width / max(1, bbox[2] - bbox[0]), height / max(1, bbox[3] - bbox[1])) * headroom
+    return max(8, int(ref * scale))
+
+
+def _downscale_mask(mask, quality, blur_radius):
+    # Shadows are blurred, so they can be worked out at a fraction of the size with no visible difference.
+    # Reducing by more than the blur radius would make the shadow visibly softer, so that sets a limit
+    k = max(1, min(round(1 / quality), int(blur_radius)))
+    if k > 1:
+        mask = mask.reduce(k)
+    return mask, k
+
+
+def _blur_mask(mask, blur_radius, k, size):
+    mask = mask.filter(ImageFilter.GaussianBlur(blur_radius / k))
+    if k > 1:
+        mask = mask.resize(size, Image.BILINEAR, box=(0, 0, size[0]/k, size[1]/k))
+    return mask
+
+
 def circle_path(t, start=0, end=360):
     theta = np.interp(t, (0,1), (np.deg2rad(start), np.deg2rad(end)))
     x = np.cos(theta)
@@ -389,8 +623,8 @@ def is_missing_glyph(char, font):
     return list(char_mask) == list(missing_mask)
 
 
-def random_hls_in_rgb(l=0.5, s=1):
-    h = random.random()
+def random_hls_in_rgb(l=0.5, s=1, rng=random):
+    h = rng.random()
     return [int(x*255) for x in colorsys.hls_to_rgb(h,l,s)]
 
 